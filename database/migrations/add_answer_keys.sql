@@ -0,0 +1,12 @@
+-- Migration: Accepted answer variants for fill-blank and short answer questions
+-- Run this in Supabase SQL Editor before loading questions converted with
+-- scripts/importD2L.py --convert --answer-keys
+--
+-- answer_keys holds one list per blank of every answer D2L accepted, already
+-- normalized (entities decoded, tags stripped, whitespace collapsed,
+-- lower-cased). gradeFillBlank() in src/services/gradingService.ts
+-- normalizes the student's answer the same way and looks it up in the list.
+-- NULL for questions without keys, which are graded against correct_answer.
+
+ALTER TABLE question_bank
+  ADD COLUMN IF NOT EXISTS answer_keys JSONB;
@@ -0,0 +1,77 @@
+-- Migration: Category x type facet summary for question_bank
+-- Run this in Supabase SQL Editor after add_admin_role.sql and add_new_question_types.sql
+--
+-- get_practice_categories() and start_practice_session() group and sample
+-- question_bank at request time. question_bank_facets keeps the approved
+-- question counts per category and type, so category lists and stratified
+-- exam assembly can read a few summary rows instead.
+
+-- ============================================================
+-- 1. Summary table, one row per category and type
+-- ============================================================
+CREATE TABLE IF NOT EXISTS question_bank_facets (
+  category TEXT NOT NULL,
+  type TEXT NOT NULL,
+  question_count INTEGER NOT NULL DEFAULT 0,
+  updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+  PRIMARY KEY (category, type)
+);
+
+ALTER TABLE question_bank_facets ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Facets are viewable by authenticated users" ON question_bank_facets;
+CREATE POLICY "Facets are viewable by authenticated users"
+  ON question_bank_facets FOR SELECT
+  TO authenticated
+  USING (true);
+
+-- The rows are authoritative only when rebuilt from question_bank by an
+-- admin (or in the SQL Editor): SELECT public.refresh_question_bank_facets();
+--
+-- scripts/d2l_facets.csv (importD2L.py --facets) counts the questions of one
+-- export, keyed the way --load inserts them (category = section, all
+-- approved). It matches the refresh only for a bank loaded from that export
+-- alone; to preview it before --load, replace the rows and refresh later:
+--   TRUNCATE question_bank_facets;
+--   \copy question_bank_facets (category, type, question_count) FROM 'scripts/d2l_facets.csv' WITH (FORMAT csv, HEADER true)
+
+-- ============================================================
+-- 2. Index for picking approved questions of one category and type
+-- ============================================================
+CREATE INDEX IF NOT EXISTS idx_question_bank_approved_category_type
+  ON question_bank(category, type)
+  WHERE status = 'approved';
+
+-- ============================================================
+-- 3. Rebuild the summary from question_bank
+-- ============================================================
+CREATE OR REPLACE FUNCTION public.refresh_question_bank_facets()
+RETURNS void
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+  -- auth.uid() is NULL only in the SQL Editor and for the service role
+  IF auth.uid() IS NOT NULL AND NOT EXISTS (
+    SELECT 1 FROM profiles
+    WHERE id = auth.uid()
+    AND role = 'admin'
+  ) THEN
+    RAISE EXCEPTION 'Only admins can refresh question facets';
+  END IF;
+
+  DELETE FROM question_bank_facets WHERE true;
+
+  INSERT INTO question_bank_facets (category, type, question_count, updated_at)
+  SELECT qb.category, qb.type, COUNT(*), NOW()
+  FROM question_bank qb
+  WHERE qb.status = 'approved'
+  GROUP BY qb.category, qb.type;
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION public.refresh_question_bank_facets FROM PUBLIC, anon;
+GRANT EXECUTE ON FUNCTION public.refresh_question_bank_facets TO authenticated;
+
+SELECT public.refresh_question_bank_facets();
@@ -0,0 +1,597 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the D2L importer (scripts/importD2L.py).
+
+Usage:
+  Parser micro-benchmark on large Matching and Fill in the Blanks items:
+     python3 scripts/bench_importD2L.py --parsers [--backend lxml|etree]
+
+  Generate a synthetic D2L export (all seven question types, embedded
+  images, some large Matching/FIB items):
+     python3 scripts/bench_importD2L.py --generate questiondb.xml --items 5000 \\
+         [--images DIR] [--mix "Matching=3,Multiple Choice=5"] [--seed N]
+
+  Benchmark suite: conversion throughput and peak memory for every mode,
+  and upload throughput against a local mock storage server:
+     python3 scripts/bench_importD2L.py --bench [--items N] [--save-baseline | --save-reference]
+
+     Results are compared with this machine's bench_baselines.local.json
+     (written by --save-baseline, not committed), or else with the committed
+     reference in bench_baselines.json (updated with --save-reference);
+     anything more than BENCH_TOLERANCE slower (or larger) than the baseline
+     is flagged.
+"""
+
+import contextlib
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import importD2L  # noqa: E402
+
+
+PARSER_SIZES = [10, 40, 160]  # premises / blanks per item
+PARSER_REPEAT_SECONDS = 0.5   # minimum time spent timing each case
+
+QUESTION_TYPES = ['Multiple Choice', 'True/False', 'Multi-Select', 'Fill in the Blanks',
+                  'Matching', 'Ordering', 'Short Answer']
+SECTION_SIZE = 250        # generated items per section
+LARGE_ITEM_EVERY = 100    # every Nth Matching/FIB item is a large one
+LARGE_ITEM_SIZE = 40      # premises / blanks of a large item
+IMAGE_EVERY = 3           # every Nth question embeds an image
+GENERATED_IMAGES = 200    # distinct image files referenced by a generated export
+
+BENCH_ITEMS = 5000        # default export size for --bench
+BENCH_UPLOAD_LATENCY = 0.01  # seconds the mock storage server spends per upload
+BENCH_BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baselines.json")  # committed
+BENCH_LOCAL_BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baselines.local.json")
+BENCH_TOLERANCE = 0.20    # relative slowdown reported as a regression
+
+# Conversion modes measured by --bench: name -> extra convert_xml_to_json() options
+CONVERT_MODES = {
+    "tree": {},
+    "stream": {"stream": True},
+    "stream+jobs": {"stream": True, "jobs": max(2, min(4, os.cpu_count() or 1))},
+}
+
+
+def mattext(text):
+    return f'<material><mattext texttype="text/html">{text}</mattext></material>'
+
+
+def html_mattext(html_text):
+    """mattext() holding escaped HTML, the way D2L exports it."""
+    return mattext(escape(html_text))
+
+
+def condition(respident, value, score, varname='D2L_Correct', action='Set'):
+    return (
+        f'<respcondition><conditionvar><varequal respident="{respident}">{value}</varequal></conditionvar>'
+        f'<setvar varname="{varname}" action="{action}">{score}</setvar></respcondition>'
+    )
+
+
+def item_metadata(q_type):
+    return (
+        '<itemmetadata><qtimetadata><qti_metadatafield><fieldlabel>qmd_questiontype</fieldlabel>'
+        f'<fieldentry>{q_type}</fieldentry></qti_metadatafield></qtimetadata></itemmetadata>'
+    )
+
+
+def matching_xml(n, ident='I1', question=None):
+    """A Matching item with n premises, n choices each and n*n conditions."""
+    groups = []
+    conditions = []
+    for g in range(n):
+        labels = ''.join(f'<response_label ident="{ident}_M{k}">{mattext(f"definition {k}")}</response_label>'
+                         for k in range(n))
+        groups.append(f'<response_grp respident="{ident}_G{g}">{mattext(f"term {g}")}'
+                      f'<render_choice>{labels}</render_choice></response_grp>')
+        for k in range(n):
+            if k == g:
+                conditions.append(condition(f'{ident}_G{g}', f'{ident}_M{k}', 1, 'D2L_Correct', 'Add'))
+            else:
+                conditions.append(condition(f'{ident}_G{g}', f'{ident}_M{k}', 0, 'D2L_Incorrect', 'Add'))
+    return (
+        f'<item ident="{ident}">{item_metadata("Matching")}'
+        f'<presentation><flow>{question or mattext("Match the terms")}{"".join(groups)}</flow></presentation>'
+        f'<resprocessing>{"".join(conditions)}</resprocessing></item>'
+    )
+
+
+def fill_blank_xml(n, ident='I1'):
+    """A Fill in the Blanks item with n blanks and two accepted answers each."""
+    parts = []
+    conditions = []
+    for b in range(n):
+        parts.append(mattext(f'text {b} '))
+        parts.append(f'<response_str ident="{ident}_S{b}"><render_fib><response_label ident="{ident}_A{b}"/>'
+                     f'</render_fib></response_str>')
+        conditions.append(condition(f'{ident}_A{b}', f'answer {b}', 100))
+        conditions.append(condition(f'{ident}_A{b}', f'variant {b}', 50))
+    return (
+        f'<item ident="{ident}">{item_metadata("Fill in the Blanks")}'
+        f'<presentation><flow>{"".join(parts)}</flow></presentation>'
+        f'<resprocessing>{"".join(conditions)}</resprocessing></item>'
+    )
+
+
+def matching_item(n):
+    return importD2L.xml_backend.fromstring(matching_xml(n))
+
+
+def fill_blank_item(n):
+    return importD2L.xml_backend.fromstring(fill_blank_xml(n))
+
+
+def choice_xml(q_type, ident, question, options, correct):
+    """Multiple Choice, True/False or Multi-Select item; `correct` is a set of indices."""
+    labels = ''.join(
+        f'<flow_label class="Block"><response_label ident="{ident}_L{k}">{html_mattext(option)}'
+        f'</response_label></flow_label>'
+        for k, option in enumerate(options)
+    )
+    if q_type == 'Multi-Select':
+        # D2L scores Multi-Select with one condition listing every option
+        checks = ''.join(
+            f'<varequal respident="{ident}_R">{ident}_L{k}</varequal>' if k in correct
+            else f'<not><varequal respident="{ident}_R">{ident}_L{k}</varequal></not>'
+            for k in range(len(options))
+        )
+        conditions = (f'<respcondition><conditionvar>{checks}</conditionvar>'
+                      f'<setvar action="Set">100</setvar></respcondition>')
+    else:
+        conditions = ''.join(condition(f'{ident}_R', f'{ident}_L{k}', 100 if k in correct else 0)
+                             for k in range(len(options)))
+    return (
+        f'<item ident="{ident}">{item_metadata(q_type)}<presentation><flow>{html_mattext(question)}'
+        f'<response_lid ident="{ident}_R"><render_choice shuffle="yes">{labels}</render_choice></response_lid>'
+        f'</flow></presentation><resprocessing>{conditions}</resprocessing></item>'
+    )
+
+
+def ordering_xml(ident, question, steps, rng):
+    labels = ''.join(f'<response_label ident="{ident}_O{k}">{mattext(f"step {k}")}</response_label>'
+                     for k in range(steps))
+    order = list(range(1, steps + 1))
+    rng.shuffle(order)
+    conditions = ''.join(condition(f'{ident}_O{k}', order[k], 1) for k in range(steps))
+    return (
+        f'<item ident="{ident}">{item_metadata("Ordering")}<presentation><flow>{html_mattext(question)}'
+        f'<response_grp respident="{ident}_OG"><render_extension><ims_render_object>{labels}'
+        f'</ims_render_object></render_extension></response_grp></flow></presentation>'
+        f'<resprocessing>{conditions}</resprocessing></item>'
+    )
+
+
+def short_answer_xml(ident, question):
+    conditions = condition(f'{ident}_SL', 'answer', 100) + condition(f'{ident}_SL', 'other answer', 100)
+    return (
+        f'<item ident="{ident}">{item_metadata("Short Answer")}<presentation><flow>{html_mattext(question)}'
+        f'<response_str ident="{ident}_S"><render_fib><response_label ident="{ident}_SL"/></render_fib>'
+        f'</response_str></flow></presentation><resprocessing>{conditions}</resprocessing></item>'
+    )
+
+
+def image_name(n):
+    return f"figure {n}.png" if n % 4 else f"diagram_{n}.svg"
+
+
+def generated_item(q_type, number, rng):
+    """XML for question `number` of type `q_type`."""
+    ident = f"QUES_{number}"
+    question = f'<p>Question {number} &amp; "quotes" — é</p>'
+    if number % IMAGE_EVERY == 0:
+        src = image_name(number % GENERATED_IMAGES).replace(' ', '%20')
+        question += f'<p><img src="{src}" alt="figure" /></p>'
+    large = number % LARGE_ITEM_EVERY == 0
+
+    if q_type == 'True/False':
+        return choice_xml(q_type, ident, question, ['True', 'False'], {number % 2})
+    if q_type == 'Multiple Choice':
+        return choice_xml(q_type, ident, question, [f'<p>Option {k}</p>' for k in range(4)], {number % 4})
+    if q_type == 'Multi-Select':
+        return choice_xml(q_type, ident, question, [f'<p>Option {k}</p>' for k in range(5)],
+                          {k for k in range(5) if (number >> k) & 1} or {0})
+    if q_type == 'Fill in the Blanks':
+        return fill_blank_xml(LARGE_ITEM_SIZE if large else rng.randint(1, 4), ident)
+    if q_type == 'Matching':
+        return matching_xml(LARGE_ITEM_SIZE if large else rng.randint(2, 5), ident, html_mattext(question))
+    if q_type == 'Ordering':
+        return ordering_xml(ident, question, rng.randint(3, 6), rng)
+    return short_answer_xml(ident, question)
+
+
+def parse_mix(text):
+    """'Matching=3,Multiple Choice=5' -> {type: weight}; unknown types are rejected."""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in QUESTION_TYPES:
+            raise ValueError(f"Unknown question type '{name}' (expected one of: {', '.join(QUESTION_TYPES)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def generate_images(images_dir, count=GENERATED_IMAGES):
+    """Write the image files a generated export references. Returns their total size."""
+    os.makedirs(images_dir, exist_ok=True)
+    rng = random.Random(count)
+    total = 0
+    for n in range(count):
+        path = os.path.join(images_dir, image_name(n))
+        if path.endswith('.svg'):
+            data = (f'<svg xmlns="http://www.w3.org/2000/svg" width="200" height="100">'
+                    f'<rect width="200" height="100" fill="#{n * 2654435761 % 0xFFFFFF:06x}"/></svg>').encode()
+        else:
+            # Not a decodable PNG, but the importer only uploads the bytes
+            data = b'\x89PNG\r\n\x1a\n' + rng.randbytes(rng.randint(2_000, 60_000))
+        with open(path, 'wb') as f:
+            f.write(data)
+        total += len(data)
+    return total
+
+
+def generate_export(path, items, mix=None, seed=1, images_dir=None):
+    """Write a QTI questiondb.xml with `items` questions. Returns {type: count}.
+
+    Items are spread over sections of SECTION_SIZE (the second one nested in
+    the first) and picked by `mix` weights, all seven types by default.
+    """
+    rng = random.Random(seed)
+    mix = mix or {q_type: 1 for q_type in QUESTION_TYPES}
+    types, weights = list(mix), list(mix.values())
+    counts = {}
+
+    if images_dir:
+        generate_images(images_dir)
+
+    def write_section(f, number, count, nested=0):
+        """Write a section of `count` items; `nested` more go in a child section."""
+        f.write(f'<section ident="SECT_{number}" title="Unit {number} &amp; review">')
+        for _ in range(count):
+            question_number[0] += 1
+            q_type = rng.choices(types, weights)[0]
+            counts[q_type] = counts.get(q_type, 0) + 1
+            f.write(generated_item(q_type, question_number[0], rng))
+        if nested:
+            write_section(f, number + 1, nested)
+        f.write('</section>')
+
+    question_number = [0]
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<questestinterop><objectbank ident="OB">')
+        remaining = items
+        section = 1
+        # The first section holds the second one, as D2L does for sub-sections
+        first = min(SECTION_SIZE, remaining)
+        nested = min(SECTION_SIZE, remaining - first)
+        write_section(f, section, first, nested)
+        remaining -= first + nested
+        section += 2
+        while remaining > 0:
+            count = min(SECTION_SIZE, remaining)
+            write_section(f, section, count)
+            remaining -= count
+            section += 1
+        f.write('</objectbank></questestinterop>\n')
+    return counts
+
+
+def time_call(fn, *args):
+    """Seconds per call, averaged over at least PARSER_REPEAT_SECONDS."""
+    calls = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < PARSER_REPEAT_SECONDS:
+        fn(*args)
+        calls += 1
+        elapsed = time.perf_counter() - start
+    return elapsed / calls
+
+
+def respcondition_score(setvar):
+    try:
+        return float(setvar.text) if setvar.text else 0
+    except ValueError:
+        return 0
+
+
+def rescanning_parse_matching(item, flow):
+    """parse_matching() before ItemIndex: every response_grp rescans all
+    respconditions. Kept as the reference for --parsers."""
+    find, findall = importD2L.find, importD2L.findall
+    matching_pairs = []
+    for resp_grp in findall(flow, './/response_grp'):
+        grp_ident = resp_grp.get('respident', '')
+        premise = importD2L.get_text_from_mattext(find(resp_grp, 'material/mattext'))
+        response_map = {label.get('ident'): importD2L.get_text_from_mattext(find(label, './/mattext'))
+                        for label in findall(resp_grp, './/response_label')}
+        correct_response = ""
+        for respcondition in findall(item, './/resprocessing/respcondition'):
+            varequal = find(respcondition, './/varequal')
+            setvar = find(respcondition, 'setvar')
+            if varequal is None or varequal.get('respident') != grp_ident or setvar is None:
+                continue
+            varname, action = setvar.get('varname', ''), setvar.get('action', '')
+            if ((varname == 'D2L_Correct' and action == 'Add')
+                    or (respcondition_score(setvar) > 0 and varname != 'D2L_Incorrect')):
+                if varequal.text in response_map:
+                    correct_response = response_map[varequal.text]
+                    break
+        matching_pairs.append({"premise": premise, "response": correct_response})
+    return {"question": importD2L.get_text_from_mattext(find(flow, 'material/mattext')),
+            "matching_pairs": matching_pairs}
+
+
+def rescanning_parse_fill_blank(item, flow):
+    """parse_fill_blank() before ItemIndex: every blank rescans all
+    respconditions. Kept as the reference for --parsers."""
+    find, findall = importD2L.find, importD2L.findall
+    parts = []
+    blanks_idents = []
+    for child in flow:
+        if child.tag == 'material':
+            parts.append(importD2L.get_text_from_mattext(find(child, 'mattext')))
+        elif child.tag == 'response_str':
+            answer_label = find(child, './/response_label')
+            blanks_idents.append(answer_label.get('ident', '') if answer_label is not None
+                                 else child.get('ident', ''))
+            parts.append('___')
+    correct_answers = []
+    for blank_ident in blanks_idents:
+        answer = ""
+        for respcondition in findall(item, './/resprocessing/respcondition'):
+            setvar = find(respcondition, 'setvar')
+            if setvar is None or respcondition_score(setvar) <= 0:
+                continue
+            varequal = find(respcondition, './/varequal')
+            if varequal is not None and varequal.get('respident') == blank_ident:
+                answer = varequal.text
+                break
+        correct_answers.append(answer)
+    return {"question": ''.join(parts), "correct_answers": correct_answers}
+
+
+def bench_parsers():
+    """Time parse_matching() and parse_fill_blank() on growing items, next to
+    the per-group / per-blank rescanning versions they replaced."""
+    print(f"XML backend: {importD2L.xml_backend.name}")
+    print(f"{'case':<28}{'rescan ms':>12}{'ms/item':>12}{'speedup':>10}")
+    cases = [(f'Matching {n}x{n}', matching_item(n), rescanning_parse_matching, importD2L.parse_matching)
+             for n in PARSER_SIZES]
+    cases += [(f'Fill in the Blanks {n}', fill_blank_item(n), rescanning_parse_fill_blank, importD2L.parse_fill_blank)
+              for n in PARSER_SIZES]
+    for name, item, reference, parser in cases:
+        flow = importD2L.find(item, './/presentation/flow')
+        before = time_call(reference, item, flow)
+        after = time_call(parser, item, flow)
+        print(f"{name:<28}{before * 1000:>12.3f}{after * 1000:>12.3f}{before / after:>9.1f}x")
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def convert_child(xml_path, out_dir, mode):
+    """Run one conversion in this (fresh) process and print its measurements as JSON."""
+    importD2L.OUTPUT_JSON = os.path.join(out_dir, "questions.json")
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        importD2L.convert_xml_to_json(xml_path=xml_path, **CONVERT_MODES[mode])
+        seconds = time.perf_counter() - start
+    print(json.dumps({
+        "seconds": seconds,
+        # Worker processes of --jobs count separately; report the larger one
+        "peak_mb": max(peak_rss_mb(), peak_rss_mb(resource.RUSAGE_CHILDREN)),
+    }))
+
+
+def bench_convert(xml_path, items, out_dir):
+    """items/s and peak memory of each conversion mode, each in its own process."""
+    results = {}
+    for mode in CONVERT_MODES:
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--convert-child', xml_path, out_dir, mode],
+                              capture_output=True, text=True, check=True)
+        measured = json.loads(proc.stdout.strip().splitlines()[-1])
+        results[f"convert {mode} items/s"] = items / measured["seconds"]
+        results[f"convert {mode} peak MB"] = measured["peak_mb"]
+    return results
+
+
+class MockStorageHandler(BaseHTTPRequestHandler):
+    """Just enough of Supabase auth and storage for upload_images()."""
+
+    protocol_version = 'HTTP/1.1'
+    latency = BENCH_UPLOAD_LATENCY
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, code, body):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.path.startswith('/auth/'):
+            self.send_json(200, {"access_token": "bench"})
+            return
+        time.sleep(self.latency)
+        self.send_json(200, {"Key": self.path})
+
+
+@contextlib.contextmanager
+def mock_storage_server():
+    """Serve MockStorageHandler on a free local port; yields its base URL."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MockStorageHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def bench_upload(images_dir, work_dir):
+    """Files/s and MB/s of upload_images() against the mock storage server."""
+    files = list(importD2L.Path(images_dir).iterdir())
+    total_bytes = sum(f.stat().st_size for f in files)
+
+    saved = {name: getattr(importD2L, name) for name in ('SUPABASE_URL', 'UPLOAD_MANIFEST')}
+    with mock_storage_server() as url:
+        importD2L.SUPABASE_URL = url
+        importD2L.UPLOAD_MANIFEST = os.path.join(work_dir, "manifest.json")
+        try:
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                start = time.perf_counter()
+                importD2L.upload_images(files=files)
+                seconds = time.perf_counter() - start
+        finally:
+            for name, value in saved.items():
+                setattr(importD2L, name, value)
+
+    return {
+        "upload files/s": len(files) / seconds,
+        "upload MB/s": total_bytes / seconds / (1024 * 1024),
+    }
+
+
+# Whether a bigger number is better, by metric name suffix
+HIGHER_IS_BETTER = {"items/s": True, "files/s": True, "MB/s": True, "peak MB": False}
+
+
+def compare_with_baseline(results, baseline):
+    """Print every metric next to its baseline; returns the regressed metric names."""
+    regressions = []
+    print(f"\n{'metric':<32}{'result':>12}{'baseline':>12}{'change':>10}")
+    for name, value in results.items():
+        base = baseline.get(name)
+        if not base:
+            print(f"{name:<32}{value:>12.1f}{'-':>12}")
+            continue
+        change = (value - base) / base
+        higher_is_better = next(better for suffix, better in HIGHER_IS_BETTER.items() if name.endswith(suffix))
+        regressed = -change > BENCH_TOLERANCE if higher_is_better else change > BENCH_TOLERANCE
+        if regressed:
+            regressions.append(name)
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{name:<32}{value:>12.1f}{base:>12.1f}{change:>+10.0%}{flag}")
+    return regressions
+
+
+def load_baselines(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def run_suite(items, save_path=None):
+    """Generate an export, run every benchmark and compare with the baselines.
+
+    The local baselines win over the committed reference when they have an
+    entry for this export size. With save_path the results are stored there
+    instead of failing on regressions.
+    """
+    work_dir = tempfile.mkdtemp(prefix="bench_importD2L_")
+    try:
+        xml_path = os.path.join(work_dir, "questiondb.xml")
+        images_dir = os.path.join(work_dir, "Fotos")
+        print(f"Generating {items} items in {work_dir}...")
+        generate_export(xml_path, items, images_dir=images_dir)
+
+        print("Benchmarking conversion...")
+        results = bench_convert(xml_path, items, work_dir)
+        print("Benchmarking uploads...")
+        results.update(bench_upload(images_dir, work_dir))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    key = str(items)
+    local = load_baselines(BENCH_LOCAL_BASELINES)
+    source = BENCH_LOCAL_BASELINES if key in local else BENCH_BASELINES
+    print(f"\nBaseline: {os.path.basename(source)}")
+    regressions = compare_with_baseline(results, load_baselines(source).get(key, {}))
+
+    if save_path:
+        baselines = load_baselines(save_path)
+        baselines[key] = results
+        with open(save_path, 'w', encoding='utf-8') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"\nSaved baseline for {items} items to: {save_path}")
+    elif regressions:
+        print(f"\n{len(regressions)} regression(s) over {BENCH_TOLERANCE:.0%}")
+        sys.exit(1)
+
+
+def main():
+    args = sys.argv[1:]
+
+    if '--backend' in args:
+        importD2L.set_xml_backend(importD2L.get_option(args, '--backend'))
+
+    if '--parsers' in args:
+        bench_parsers()
+        return
+
+    if '--convert-child' in args:
+        # Internal: one measured conversion, see bench_convert()
+        i = args.index('--convert-child')
+        convert_child(*args[i + 1:i + 4])
+        return
+
+    if '--generate' in args:
+        path = importD2L.get_option(args, '--generate')
+        mix = importD2L.get_option(args, '--mix')
+        try:
+            mix = parse_mix(mix) if mix else None
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        counts = generate_export(path, int(importD2L.get_option(args, '--items', 1000)),
+                                 mix=mix,
+                                 seed=int(importD2L.get_option(args, '--seed', 1)),
+                                 images_dir=importD2L.get_option(args, '--images'))
+        print(f"Wrote {sum(counts.values())} items to: {path}")
+        for q_type, count in sorted(counts.items()):
+            print(f"  {q_type}: {count}")
+        return
+
+    if '--bench' in args:
+        save_path = None
+        if '--save-baseline' in args:
+            save_path = BENCH_LOCAL_BASELINES
+        elif '--save-reference' in args:
+            save_path = BENCH_BASELINES
+        run_suite(int(importD2L.get_option(args, '--items', BENCH_ITEMS)), save_path=save_path)
+        return
+
+    print("Usage:")
+    print("  python3 scripts/bench_importD2L.py --parsers [--backend lxml|etree]")
+    print("      Time the parsers on large Matching/FIB items against the old rescanning versions")
+    print("  python3 scripts/bench_importD2L.py --generate OUT.xml [--items N] [--images DIR] [--mix SPEC] [--seed N]")
+    print("  python3 scripts/bench_importD2L.py --bench [--items N] [--save-baseline | --save-reference]")
+
+
+if __name__ == '__main__':
+    main()
@@ -11,39 +11,350 @@ Usage:
 
   3. Both:
      python3 scripts/importD2L.py --upload-images --convert
+
+  Add --stream to --convert for large exports: the XML is parsed
+  incrementally instead of loading the whole tree.
+  Add --ndjson to write one question per line to d2l_questions.ndjson.
+  Add --search-index to also build d2l_search.sqlite, an FTS5 index of the
+  question and option text (tags stripped, entities decoded), and query it
+  offline with --search "words" [--section S] [--type T] [--limit N].
+  Add --near-duplicates to also write d2l_near_duplicates.json: clusters of
+  reworded copies found with MinHash/LSH over the question and option text.
+  Across courses: --near-duplicates courseA.json courseB.ndjson d2l_compact/
+  Add --facets to also write d2l_facets.json: question ids (as [first, last]
+  runs) and counts per section x question_bank type, sorted, plus
+  d2l_facets.csv, this export's counts in question_bank_facets form
+  (database/migrations/add_question_facets.sql rebuilds the authoritative
+  counts from question_bank). --facet-sample N draws a
+  stratified random exam from the index alone.
+  Add --answer-keys to give Fill in the Blanks and Short Answer questions an
+  "answer_keys" list (one per blank): every answer a positive-scoring
+  respcondition accepts (<or> alternatives included), entity-decoded,
+  tag-stripped, whitespace-collapsed and lower-cased. --load stores them in
+  question_bank.answer_keys (database/migrations/add_answer_keys.sql), and
+  gradeFillBlank() normalizes the student's answer the same way and looks it
+  up in them.
+  Add --compact to write d2l_compact/: one gzipped NDJSON shard per section
+  and a manifest.json, with image URLs relative to one base and correct
+  answers stored as option indices. --load accepts the folder too.
+  Add --jobs N to convert items on N processes (same output as a serial run).
+  Add --cache to keep converted items in d2l_parse_cache.sqlite: a re-export
+  of the same bank only converts the items that changed.
+  For a quick look at an export, --scan [questiondb.xml] prints the same
+  per-type summary from metadata alone (one expat pass, no HTML decoding).
+  XML is parsed with lxml when it is installed (paths precompiled to XPath),
+  otherwise with ElementTree; force one with --backend lxml|etree. Check
+  that both give the same output with --check-backends [questiondb.xml].
+  Add --pipeline to --all to upload images while the XML is converted: each
+  image is queued as soon as a question references it (implies
+  --referenced-only). Failed uploads are listed with the questions using them.
+  Add --optimize to recompress images before upload (PNG lossless, JPEG with
+  its own quality, SVG minified; needs Pillow for PNG/JPEG) into
+  d2l_optimized/. --webp adds <name>.webp variants, --capped [N] adds
+  <stem>@N renditions no larger than N px (default 1600). With
+  --image-variant webp|capped the converted URLs point at that variant.
+  Add --profile to write d2l_profile.json next to the output: time per phase
+  (XML parsing, conversion, text helpers, writing, uploads), latency
+  histograms per question type, the slowest items and peak memory (not
+  with --zip).
+  Add --workers N to --upload-images to change the number of parallel uploads.
+  Uploads are recorded in d2l_upload_manifest.json; unchanged images are
+  skipped on the next run. Add --verify-remote to re-check the manifest
+  against a bulk listing of the bucket first.
+  Inline base64 images (src="data:image/...") are decoded into
+  d2l_inline_images/inline-<hash>.<ext>, <hash> being the first 32 hex digits
+  (128 bits) of the image's SHA-256, linked by storage URL and uploaded with
+  the other images, so each one is stored once.
+  Add --referenced-only to upload only the images the questions reference.
+  The conversion then runs first, saves the references to
+  d2l_image_refs.json and reports broken references and unused files.
+
+  4. Straight from D2L export zips (no unzip step), N archives at a time:
+     python3 scripts/importD2L.py --all --zip export1.zip export2.zip --jobs N
+
+     questiondb.xml and the images are streamed from each archive. Every
+     archive gets its own namespace: images go to question-images/<name>/
+     and outputs to scripts/d2l_exports/<name>/.
+
+  5. Bulk-insert the converted questions into question_bank (same mapping
+     and duplicate check as the in-app import, 500 rows per request):
+     python3 scripts/importD2L.py --load [d2l_questions.json|.ndjson]
+
+     Or write a CSV for psql's \\copy instead:
+     python3 scripts/importD2L.py --load --copy-file rows.csv --created-by <uuid>
+
+  6. Skip questions that were already imported:
+     python3 scripts/importD2L.py --build-fingerprints old_export.json bank_dump.csv
+     python3 scripts/importD2L.py --convert --dedupe drop   (or flag)
+
+     The index (d2l_fingerprints.txt) holds one content hash per question:
+     type, tag-stripped text, options and answers.
+
+  7. Export converted questions back to D2L (all seven types):
+     python3 scripts/importD2L.py --export-qti [d2l_questions.json|.ndjson|d2l_compact] [--out questiondb.xml]
+
+     The XML is written element by element, so memory stays flat for any
+     bank size. Image URLs go back to the export's filenames. Add
+     --check-roundtrip to parse the result with the converter and compare.
 """
 
 import xml.etree.ElementTree as ET
+import xml.parsers.expat as expat
+from xml.sax.saxutils import XMLGenerator
+import base64
+import contextlib
+import csv
+import gzip
+import hashlib
+import heapq
 import html
+import io
 import json
+import operator
 import os
+import posixpath
+import random
 import re
+import sqlite3
 import sys
+import threading
+import time
+import tracemalloc
+import unicodedata
 import urllib.parse
 import mimetypes
+import zipfile
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
+from types import SimpleNamespace
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None  # optional: the ElementTree backend is used instead
 
 # ====== Configuration ======
 XML_PATH = "/Users/admin/Downloads/D2LExport_424260_202610_ISIS2403_3_202621159/questiondb.xml"
 FOTOS_DIR = "/Users/admin/Downloads/Fotos"
 OUTPUT_JSON = os.path.join(os.path.dirname(__file__), "d2l_questions.json")
-
-SUPABASE_URL = "https://djlwdmkdyoqsfmqewryi.supabase.co"
+OUTPUT_NDJSON = os.path.join(os.path.dirname(__file__), "d2l_questions.ndjson")
+ARCHIVES_OUTPUT_DIR = os.path.join(os.path.dirname(__file__), "d2l_exports")  # --zip outputs, one folder per archive
+FLUSH_EVERY = 200  # questions written between explicit flushes of the output file
+JOBS_BATCH_SIZE = 50  # items sent to a worker process at a time (--jobs N)
+JOBS_QUEUE_DEPTH = 4  # batches in flight per worker process
+
+# SUPABASE_URL can be overridden, e.g. to point uploads at a local mock server
+SUPABASE_URL = os.environ.get("SUPABASE_URL", "https://djlwdmkdyoqsfmqewryi.supabase.co")
 SUPABASE_KEY = "sb_publishable_l3PVIevAcxFmMKLycceoCw_iVdQ0KKk"
 STORAGE_BUCKET = "exam-materials"
 STORAGE_PATH = "question-images"
 
 BASE_IMAGE_URL = f"{SUPABASE_URL}/storage/v1/object/public/{STORAGE_BUCKET}/{STORAGE_PATH}"
 
+UPLOAD_WORKERS = 8     # concurrent uploads (override with --workers N)
+UPLOAD_RETRIES = 5     # retries per request on 429/5xx and connection errors
+UPLOAD_BACKOFF = 0.5   # seconds; doubles on every retry
+
+# Uploaded files are recorded here (storage path -> sha256, size, mtime) so
+# re-runs skip unchanged images and interrupted runs resume.
+UPLOAD_MANIFEST = os.path.join(os.path.dirname(__file__), "d2l_upload_manifest.json")
+MANIFEST_SAVE_EVERY = 50  # completed uploads between manifest checkpoints
+LIST_PAGE_SIZE = 1000     # objects per bulk listing request (--verify-remote)
+IMAGE_EXTENSIONS = {'.svg', '.png', '.jpg', '.jpeg', '.gif', '.webp'}
+
+LOAD_BATCH_SIZE = 500  # question_bank rows per insert request (--load)
+LOAD_WORKERS = 4       # insert requests in flight
+
+# Fingerprints of questions already imported (--build-fingerprints / --dedupe)
+FINGERPRINT_INDEX = os.path.join(os.path.dirname(__file__), "d2l_fingerprints.txt")
+
+# Converted items cached by content (--cache)
+PARSE_CACHE = os.path.join(os.path.dirname(__file__), "d2l_parse_cache.sqlite")
+PARSE_CACHE_MAX_BYTES = 256 * 1024 * 1024  # least recently used entries are evicted past this
+CONVERTER_VERSION = 3  # bump when parser output changes; drops every cached item
+
+# Add normalized "answer_keys" to Fill in the Blanks and Short Answer questions (--answer-keys)
+ANSWER_KEYS = False
+
+# Settings that --zip rewrites per archive (see archive_namespace)
+NAMESPACED_SETTINGS = ('STORAGE_PATH', 'BASE_IMAGE_URL', 'OUTPUT_JSON', 'OUTPUT_NDJSON', 'UPLOAD_MANIFEST',
+                       'image_url_map')
+manifest_lock = threading.Lock()
+
+# Files above this size use resumable (TUS) uploads in fixed-size chunks.
+# Supabase requires 6 MB chunks for resumable uploads.
+RESUMABLE_THRESHOLD = 6 * 1024 * 1024
+RESUMABLE_CHUNK_SIZE = 6 * 1024 * 1024
+
+# Image optimization (--optimize); Pillow is optional, without it only SVGs are minified
+WEBP_QUALITY = 85          # lossy WebP variants of JPEGs (PNGs get lossless WebP)
+CAPPED_JPEG_QUALITY = 85   # size-capped renditions of JPEGs (--capped)
+IMAGE_MAX_DIMENSION = 1600  # longest side of the size-capped rendition (--capped [N])
+IMAGE_VARIANTS = ('optimized', 'webp', 'capped')  # what --image-variant can point URLs at
+IMAGE_FORMAT_EXTENSIONS = {'JPEG': ('.jpg', '.jpeg'), 'PNG': ('.png',), 'GIF': ('.gif',), 'WEBP': ('.webp',),
+                           'BMP': ('.bmp',)}  # Pillow format -> extensions, the first used for new names
+
+# XML backend: 'lxml' when installed, else 'etree' (override with --backend)
+XML_BACKEND = 'lxml' if lxml_etree is not None else 'etree'
+
+# --profile report
+PROFILE_REPORT_NAME = "d2l_profile.json"  # written next to OUTPUT_JSON
+PROFILE_SLOWEST = 20  # slowest items listed in the report
+PROFILE_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250)  # latency histogram upper bounds
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(p / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[rank]
+
+
+def latency_summary(seconds):
+    """count / mean / p50 / p90 / p99 / max in milliseconds."""
+    values = sorted(s * 1000 for s in seconds)
+    return {
+        "count": len(values),
+        "mean_ms": sum(values) / len(values) if values else 0.0,
+        "p50_ms": percentile(values, 50),
+        "p90_ms": percentile(values, 90),
+        "p99_ms": percentile(values, 99),
+        "max_ms": values[-1] if values else 0.0,
+    }
+
 
-def authenticate():
-    """Authenticate with Supabase and return access token."""
+class Profiler:
+    """Measurements for --profile, written as JSON by write_report().
+
+    Phases are wall-clock totals and nest: "convert items" includes the time
+    spent in "decode_html_text" and "replace_image_urls". Per-item latencies
+    are only measured when items are converted in this process (not --jobs).
+    tracemalloc is on for the whole run, which slows everything down somewhat.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.phases = {}
+        self.item_latencies = {}  # question type -> [seconds]
+        self.slowest = []  # min-heap of (seconds, ident, question type)
+        self.uploads = []  # (seconds, bytes sent)
+        self.started = time.perf_counter()
+        tracemalloc.start()
+
+    def add_phase(self, name, seconds):
+        with self.lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - start)
+
+    def timed(self, name, fn):
+        """`fn` wrapped so that its calls count towards phase `name`."""
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add_phase(name, time.perf_counter() - start)
+        return wrapper
+
+    def timed_iter(self, name, iterable):
+        """Iterate `iterable`, counting only the time spent producing items."""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                value = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.add_phase(name, time.perf_counter() - start)
+            yield value
+
+    def add_item(self, ident, q_type, seconds):
+        self.item_latencies.setdefault(q_type, []).append(seconds)
+        entry = (seconds, ident or '', q_type)
+        if len(self.slowest) < PROFILE_SLOWEST:
+            heapq.heappush(self.slowest, entry)
+        elif entry > self.slowest[0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def add_upload(self, seconds, size):
+        with self.lock:
+            self.uploads.append((seconds, size))
+
+    def report(self):
+        item_types = {}
+        for q_type, latencies in sorted(self.item_latencies.items()):
+            histogram = {f"<={bound}": 0 for bound in PROFILE_BUCKETS_MS}
+            histogram[f">{PROFILE_BUCKETS_MS[-1]}"] = 0
+            for seconds in latencies:
+                ms = seconds * 1000
+                bucket = next((f"<={bound}" for bound in PROFILE_BUCKETS_MS if ms <= bound),
+                              f">{PROFILE_BUCKETS_MS[-1]}")
+                histogram[bucket] += 1
+            item_types[q_type] = {**latency_summary(latencies), "histogram_ms": histogram}
+
+        report = {
+            "total_seconds": time.perf_counter() - self.started,
+            "phases_seconds": dict(sorted(self.phases.items(), key=lambda phase: -phase[1])),
+            "item_types": item_types,
+            "slowest_items": [
+                {"ident": ident, "type": q_type, "ms": seconds * 1000}
+                for seconds, ident, q_type in sorted(self.slowest, reverse=True)
+            ],
+            "tracemalloc_peak_mb": tracemalloc.get_traced_memory()[1] / (1024 * 1024),
+        }
+        if self.uploads:
+            upload_seconds = self.phases.get("upload images", 0.0)
+            sent = sum(size for _, size in self.uploads)
+            report["uploads"] = {
+                **latency_summary([seconds for seconds, _ in self.uploads]),
+                "bytes": sent,
+                "bytes_per_second": sent / upload_seconds if upload_seconds else 0.0,
+            }
+        return report
+
+    def write_report(self):
+        path = os.path.join(os.path.dirname(OUTPUT_JSON), PROFILE_REPORT_NAME)
+        report = self.report()
+        tracemalloc.stop()
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nProfile written to: {path}")
+        for name, seconds in list(report["phases_seconds"].items())[:6]:
+            print(f"  {name}: {seconds:.2f}s")
+
+
+profiler = None  # a Profiler while --profile is active
+
+
+def profile_phase(name):
+    """Context manager timing phase `name` when profiling, else a no-op."""
+    return profiler.phase(name) if profiler is not None else contextlib.nullcontext()
+
+
+def import_requests():
+    """Import requests, installing it on first use."""
     try:
         import requests
     except ImportError:
         print("Installing requests...")
         os.system(f"{sys.executable} -m pip install requests")
         import requests
+    return requests
+
+
+def authenticate():
+    """Authenticate with Supabase and return access token."""
+    requests = import_requests()
 
     print("Authenticating with Supabase...")
     resp = requests.post(
@@ -67,74 +378,803 @@ def authenticate():
     return token
 
 
-def upload_images():
-    """Upload all images from Fotos folder to Supabase Storage."""
+def create_session(workers, retry_post=True):
+    """Return a requests.Session with a keep-alive pool sized for `workers`.
+
+    Requests are retried with exponential backoff on 429 and 5xx responses
+    (honouring Retry-After) and on dropped connections. Storage uploads are
+    upserts, so POST is retried too; with retry_post=False (question_bank
+    inserts) a POST is only retried when it failed to connect, never once
+    the request may have reached the server.
+    """
+    requests = import_requests()
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(
+        total=UPLOAD_RETRIES,
+        backoff_factor=UPLOAD_BACKOFF,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=None if retry_post else Retry.DEFAULT_ALLOWED_METHODS,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_content_type(filename):
+    """Guess the MIME type to store an image with."""
+    content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    if filename.endswith('.svg'):
+        content_type = "image/svg+xml"
+    return content_type
+
+
+def file_sha256(file_path):
+    """Hex SHA-256 of a file, read in 1 MB chunks."""
+    digest = hashlib.sha256()
+    with file_path.open('rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest():
+    """Load the upload manifest: storage path -> {sha256, size, mtime}.
+
+    Returns an empty manifest if there is none yet, or if it was written for
+    a different Supabase project or bucket.
+    """
+    target = f"{SUPABASE_URL}/{STORAGE_BUCKET}"
     try:
-        import requests
-    except ImportError:
-        print("Installing requests...")
-        os.system(f"{sys.executable} -m pip install requests")
-        import requests
+        with open(UPLOAD_MANIFEST, encoding='utf-8') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return {"target": target, "objects": {}}
+    except ValueError:
+        print(f"Warning: ignoring unreadable manifest {UPLOAD_MANIFEST}")
+        return {"target": target, "objects": {}}
+
+    if manifest.get("target") != target:
+        print(f"Manifest was written for {manifest.get('target')}, starting a new one")
+        return {"target": target, "objects": {}}
+    return manifest
+
+
+def save_manifest(manifest):
+    """Write the manifest atomically so a crash never leaves it half-written."""
+    tmp_path = UPLOAD_MANIFEST + ".tmp"
+    with manifest_lock, open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp_path, UPLOAD_MANIFEST)
+
+
+def list_remote_objects(session, headers):
+    """List STORAGE_PATH in the bucket with paged bulk requests.
+
+    Returns {object name: size or None} for every object under the prefix.
+    """
+    objects = {}
+    offset = 0
+    while True:
+        resp = session.post(
+            f"{SUPABASE_URL}/storage/v1/object/list/{STORAGE_BUCKET}",
+            headers=headers,
+            json={
+                "prefix": STORAGE_PATH,
+                "limit": LIST_PAGE_SIZE,
+                "offset": offset,
+                "sortBy": {"column": "name", "order": "asc"},
+            },
+        )
+        if resp.status_code != 200:
+            raise RuntimeError(f"listing {STORAGE_PATH} failed: {resp.status_code} {resp.text[:200]}")
+
+        page = resp.json()
+        for obj in page:
+            if obj.get("id") is None:
+                continue  # sub-folder placeholder
+            objects[obj["name"]] = (obj.get("metadata") or {}).get("size")
+        if len(page) < LIST_PAGE_SIZE:
+            return objects
+        offset += LIST_PAGE_SIZE
+
+
+def verify_manifest(manifest, session, headers):
+    """Drop manifest entries whose object is missing remotely or has another size."""
+    remote = list_remote_objects(session, headers)
+    objects = manifest["objects"]
+    stale = []
+    for storage_path, entry in objects.items():
+        name = storage_path[len(STORAGE_PATH) + 1:]
+        size = remote.get(name, -1)
+        if size == -1 or (size is not None and size != entry["size"]):
+            stale.append(storage_path)
+    for storage_path in stale:
+        del objects[storage_path]
+    print(f"Verified manifest against {len(remote)} remote objects: {len(stale)} entries will be re-uploaded")
+
+
+def upload_resumable(session, headers, file_path, storage_path, sha256, manifest):
+    """Upload a large file in RESUMABLE_CHUNK_SIZE pieces over the TUS protocol.
+
+    The upload URL is remembered under manifest["partial"], so a transfer that
+    fails (in this run or a previous one) continues from the last chunk the
+    server acknowledged instead of starting over. Only one chunk is held in
+    memory at a time. Returns (status_code, response_text).
+    """
+    tus_headers = {**headers, "Tus-Resumable": "1.0.0"}
+    size = file_path.stat().st_size
+    partial = manifest.setdefault("partial", {})
+
+    def create_upload():
+        metadata = {
+            "bucketName": STORAGE_BUCKET,
+            "objectName": storage_path,
+            "contentType": get_content_type(file_path.name),
+            "cacheControl": "3600",
+        }
+        resp = session.post(
+            f"{SUPABASE_URL}/storage/v1/upload/resumable",
+            headers={
+                **tus_headers,
+                "Upload-Length": str(size),
+                "Upload-Metadata": ",".join(
+                    f"{k} {base64.b64encode(v.encode()).decode()}" for k, v in metadata.items()
+                ),
+                "x-upsert": "true",
+            },
+        )
+        if resp.status_code != 201:
+            return None, resp
+        url = urllib.parse.urljoin(f"{SUPABASE_URL}/storage/v1/upload/resumable", resp.headers["Location"])
+        with manifest_lock:
+            partial[storage_path] = {"url": url, "sha256": sha256}
+        return url, resp
+
+    def server_offset(url):
+        resp = session.head(url, headers=tus_headers)
+        if resp.status_code != 200:
+            return None
+        return int(resp.headers.get("Upload-Offset", 0))
+
+    url = None
+    offset = None
+    previous = partial.get(storage_path)
+    if previous and previous.get("sha256") == sha256:
+        url = previous["url"]
+        offset = server_offset(url)
+    if offset is None:
+        url, resp = create_upload()
+        if url is None:
+            return resp.status_code, resp.text
+        offset = 0
+
+    attempts = 0
+    with file_path.open('rb') as f:
+        while offset < size:
+            f.seek(offset)
+            chunk = f.read(RESUMABLE_CHUNK_SIZE)
+            try:
+                resp = session.patch(
+                    url,
+                    headers={
+                        **tus_headers,
+                        "Upload-Offset": str(offset),
+                        "Content-Type": "application/offset+octet-stream",
+                    },
+                    data=chunk,
+                )
+                ok = resp.status_code == 204
+                error = (resp.status_code, resp.text)
+            except Exception as e:
+                ok = False
+                error = (None, str(e))
+
+            if ok:
+                offset = int(resp.headers.get("Upload-Offset", offset + len(chunk)))
+                attempts = 0
+                continue
+
+            # Ask the server how much it kept and continue from there
+            attempts += 1
+            if attempts > UPLOAD_RETRIES:
+                return error
+            try:
+                new_offset = server_offset(url)
+            except Exception:
+                new_offset = None
+            if new_offset is None:
+                return error
+            offset = new_offset
+
+    with manifest_lock:
+        partial.pop(storage_path, None)
+    return 200, ""
+
+
+def upload_file(session, headers, file_path, storage_path, known_sha256=None, manifest=None):
+    """Upload one file with upsert. Returns (status_code, response_text, sha256).
+
+    If the content hash equals known_sha256 nothing is sent and the status is
+    304, so a touched-but-unchanged file is not uploaded again. The body is
+    streamed from the open file; files larger than RESUMABLE_THRESHOLD go
+    through upload_resumable() instead.
+    """
+    sha256 = file_sha256(file_path)
+    if sha256 == known_sha256:
+        return 304, "", sha256
+
+    if manifest is not None and file_path.stat().st_size > RESUMABLE_THRESHOLD:
+        status_code, text = upload_resumable(session, headers, file_path, storage_path, sha256, manifest)
+        return status_code, text, sha256
+
+    upload_url = f"{SUPABASE_URL}/storage/v1/object/{STORAGE_BUCKET}/{storage_path}"
+
+    with file_path.open('rb') as f:
+        # Try upsert (overwrite if exists); retries rewind the file
+        resp = session.post(
+            upload_url,
+            headers={
+                **headers,
+                "Content-Type": get_content_type(file_path.name),
+                "x-upsert": "true",
+            },
+            data=f,
+        )
+    return resp.status_code, resp.text, sha256
+
+
+def timed_upload(session, headers, file_path, storage_path, known_sha256=None, manifest=None):
+    """upload_file() recording its latency and size for the --profile report."""
+    start = time.perf_counter()
+    result = upload_file(session, headers, file_path, storage_path, known_sha256, manifest)
+    if result[0] in (200, 201):
+        profiler.add_upload(time.perf_counter() - start, file_path.stat().st_size)
+    return result
 
-    access_token = authenticate()
 
+def list_media_files():
+    """Image files in FOTOS_DIR, or None if the folder does not exist."""
     fotos = Path(FOTOS_DIR)
     if not fotos.exists():
         print(f"Error: Fotos directory not found: {FOTOS_DIR}")
-        return
+        return None
 
     # Get all image files (skip PDFs and other non-image files)
-    image_extensions = {'.svg', '.png', '.jpg', '.jpeg', '.gif', '.webp'}
-    files = [f for f in fotos.iterdir() if f.suffix.lower() in image_extensions]
+    return [f for f in fotos.iterdir() if f.suffix.lower() in IMAGE_EXTENSIONS]
+
+
+def normalize_media_name(name):
+    """Key for matching an image reference to a file name.
+
+    Ignores URL encoding, directories, Unicode normalization form (macOS
+    stores NFD names) and case.
+    """
+    name = urllib.parse.unquote(name).replace('\\', '/')
+    return unicodedata.normalize('NFC', posixpath.basename(name)).casefold()
+
+
+def build_media_index(files):
+    """Index media files by exact name and by normalize_media_name()."""
+    exact = {}
+    normalized = {}
+    for f in files:
+        exact.setdefault(f.name, f)
+        normalized.setdefault(normalize_media_name(f.name), f)
+    return exact, normalized
+
+
+def resolve_image_ref(media_index, ref):
+    """Return the media file an image reference points to, or None."""
+    exact, normalized = media_index
+    file_path = exact.get(ref) or normalized.get(normalize_media_name(ref))
+    if file_path is None and ref.startswith('inline-'):
+        inline = Path(inline_images_dir()) / ref
+        file_path = inline if inline.is_file() else None
+    return file_path
+
+
+def image_refs_path():
+    """Sidecar with the images referenced by the last conversion."""
+    return os.path.join(os.path.dirname(OUTPUT_JSON), "d2l_image_refs.json")
+
+
+def referenced_uploads(files):
+    """(file, object name) pairs for the images the converted questions use.
+
+    Each image is stored under the name its questions reference, so the URLs
+    written by replace_image_urls() resolve even when the file on disk differs
+    in case or Unicode form. Returns None if there is no conversion yet.
+    """
+    try:
+        with open(image_refs_path(), encoding='utf-8') as f:
+            image_refs = json.load(f)["referenced"]
+    except FileNotFoundError:
+        print(f"Error: {image_refs_path()} not found, run --convert --referenced-only first")
+        return None
+
+    media_index = build_media_index(files)
+    uploads = []
+    broken = 0
+    for ref in sorted(image_refs):
+        file_path = resolve_image_ref(media_index, ref)
+        if file_path is None:
+            broken += 1
+        else:
+            uploads.append((file_path, ref))
+    print(f"{len(image_refs)} referenced images ({broken} broken references skipped)")
+    return uploads
+
+
+def report_image_refs(image_refs, files):
+    """Print references to missing images and media files nothing uses."""
+    media_index = build_media_index(files)
+    used = set()
+    broken = {}
+    for ref, question_ids in image_refs.items():
+        file_path = resolve_image_ref(media_index, ref)
+        if file_path is None:
+            broken[ref] = question_ids
+        else:
+            used.add(file_path.name)
+
+    print(f"\nImages: {len(image_refs)} referenced, {len(files)} in media folder")
+    if broken:
+        print(f"Broken references ({len(broken)}):")
+        for ref in sorted(broken)[:20]:
+            print(f"  {ref} (questions {', '.join(str(q) for q in broken[ref][:10])})")
+        if len(broken) > 20:
+            print(f"  ... and {len(broken) - 20} more")
+
+    unused = sorted(f.name for f in files if f.name not in used)
+    if unused:
+        unused_bytes = sum(f.stat().st_size for f in files if f.name not in used)
+        print(f"Unused files ({len(unused)}, {unused_bytes / 1024 / 1024:.1f} MB, "
+              f"not uploaded with --referenced-only):")
+        for name in unused[:20]:
+            print(f"  {name}")
+        if len(unused) > 20:
+            print(f"  ... and {len(unused) - 20} more")
+
 
-    print(f"Found {len(files)} image files to upload")
+def manifest_unchanged(entry, stat):
+    """True if a manifest entry still matches the file's size and mtime."""
+    return bool(entry) and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime
+
+
+def record_upload(manifest, counts, storage_path, stat, future):
+    """Count a finished upload and record it in the manifest.
+
+    Returns an error message for a failed upload, else None.
+    """
+    try:
+        status_code, text, sha256 = future.result()
+    except Exception as e:
+        status_code, text, sha256 = None, str(e), None
+
+    if status_code in (200, 201, 304):
+        counts["unchanged" if status_code == 304 else "uploaded"] += 1
+        with manifest_lock:
+            manifest["objects"][storage_path] = {"sha256": sha256, "size": stat.st_size, "mtime": stat.st_mtime}
+        return None
+    if status_code == 409:
+        counts["skipped"] += 1  # Already exists
+        return None
+    counts["errors"] += 1
+    return f"{status_code} {text[:200]}"
+
+
+def print_upload_counts(counts):
+    print(f"\nUpload complete: {counts['uploaded']} uploaded, {counts['skipped']} already existed, "
+          f"{counts['unchanged']} unchanged, {counts['errors']} errors")
+
+
+def upload_images(workers=None, verify_remote=False, files=None, referenced_only=False):
+    """Upload all images from Fotos folder to Supabase Storage.
+
+    Files are uploaded by `workers` threads (default UPLOAD_WORKERS) sharing
+    one pooled session. Files whose size and mtime match the upload manifest
+    are skipped without being read. The manifest is saved as uploads finish,
+    so an interrupted run resumes where it stopped. With verify_remote=True
+    the manifest is first checked against one bulk listing of the bucket.
+    `files` replaces the Fotos folder listing, e.g. with ZipMember entries.
+    With referenced_only=True only the images used by the last conversion
+    are uploaded (see referenced_uploads).
+    """
+    workers = workers or UPLOAD_WORKERS
+
+    if files is None:
+        files = list_media_files()
+        if files is None:
+            return
+
+    if referenced_only:
+        uploads = referenced_uploads(files)
+        if uploads is None:
+            return
+    else:
+        uploads = [(f, f.name) for f in files]
+
+    access_token = authenticate()
 
     headers = {
         "Authorization": f"Bearer {access_token}",
         "apikey": SUPABASE_KEY,
     }
 
-    uploaded = 0
-    skipped = 0
-    errors = 0
+    manifest = load_manifest()
+    objects = manifest["objects"]
+    counts = {"uploaded": 0, "skipped": 0, "unchanged": 0, "errors": 0}
+
+    session = create_session(workers)
+    with session:
+        if verify_remote:
+            verify_manifest(manifest, session, headers)
+
+        pending = []
+        for file_path, name in sorted(uploads, key=lambda upload: upload[1]):
+            storage_path = f"{STORAGE_PATH}/{name}"
+            stat = file_path.stat()
+            entry = objects.get(storage_path)
+            if manifest_unchanged(entry, stat):
+                counts["unchanged"] += 1
+            else:
+                pending.append((file_path, storage_path, stat))
 
-    for i, file_path in enumerate(sorted(files)):
-        filename = file_path.name
-        storage_path = f"{STORAGE_PATH}/{filename}"
+        print(f"Found {len(uploads)} image files, {len(pending)} to upload "
+              f"({counts['unchanged']} unchanged, {workers} workers)")
 
-        # Determine content type
-        content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
-        if filename.endswith('.svg'):
-            content_type = "image/svg+xml"
+        upload = upload_file if profiler is None else timed_upload
 
-        upload_url = f"{SUPABASE_URL}/storage/v1/object/{STORAGE_BUCKET}/{storage_path}"
+        with profile_phase("upload images"), ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(upload, session, headers, file_path, storage_path,
+                                objects.get(storage_path, {}).get("sha256"), manifest): (file_path, storage_path, stat)
+                for file_path, storage_path, stat in pending
+            }
 
-        with open(file_path, 'rb') as f:
-            file_data = f.read()
+            try:
+                for i, future in enumerate(as_completed(futures)):
+                    file_path, storage_path, stat = futures[future]
+                    error = record_upload(manifest, counts, storage_path, stat, future)
+                    if error:
+                        print(f"  Error uploading {storage_path[len(STORAGE_PATH) + 1:]}: {error}")
 
-        # Try upsert (overwrite if exists)
-        resp = requests.post(
-            upload_url,
-            headers={
-                **headers,
-                "Content-Type": content_type,
-                "x-upsert": "true",
-            },
-            data=file_data,
-        )
+                    if (i + 1) % MANIFEST_SAVE_EVERY == 0:
+                        save_manifest(manifest)
+
+                    if (i + 1) % 20 == 0:
+                        print(f"  Progress: {i + 1}/{len(pending)} (uploaded: {counts['uploaded']}, "
+                              f"skipped: {counts['skipped']}, errors: {counts['errors']})")
+            finally:
+                save_manifest(manifest)
+
+    print_upload_counts(counts)
+
+
+def upload_inline_images(workers=None):
+    """Upload the images the last conversion extracted from data: URIs."""
+    files = list_inline_images()
+    if files:
+        print(f"Uploading {len(files)} images extracted from inline data: URIs")
+        upload_images(workers=workers, files=files)
+
+
+class PipelineUploader:
+    """Uploads images while the conversion is still running (--pipeline).
 
-        if resp.status_code in (200, 201):
-            uploaded += 1
-        elif resp.status_code == 409:
-            skipped += 1  # Already exists
+    add() is called for every converted question with the image references
+    it found; each referenced image is queued for upload the first time it
+    is seen, stored under the referenced name like referenced_uploads().
+    finish() waits for the queue and reports failed uploads together with
+    the questions that use them.
+    """
+
+    def __init__(self, files, workers=None, verify_remote=False):
+        self.workers = workers or UPLOAD_WORKERS
+        self.media_index = build_media_index(files)
+        self.headers = {
+            "Authorization": f"Bearer {authenticate()}",
+            "apikey": SUPABASE_KEY,
+        }
+        self.manifest = load_manifest()
+        self.counts = {"uploaded": 0, "skipped": 0, "unchanged": 0, "errors": 0}
+        self.session = create_session(self.workers)
+        if verify_remote:
+            verify_manifest(self.manifest, self.session, self.headers)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.upload = upload_file if profiler is None else timed_upload
+        self.started = time.perf_counter()
+
+        self.questions = {}  # reference -> question ids using it
+        self.futures = {}    # in-flight future -> (reference, storage_path, stat)
+        self.finished = deque()  # futures done but not yet collected, appended by the upload threads
+        self.failed = {}     # reference -> error message
+        self.done = 0
+
+    def add(self, question_id, refs):
+        for ref in refs:
+            question_ids = self.questions.get(ref)
+            if question_ids is not None:
+                if question_ids[-1] != question_id:
+                    question_ids.append(question_id)
+                continue
+            self.questions[ref] = [question_id]
+
+            file_path = resolve_image_ref(self.media_index, ref)
+            if file_path is None:
+                continue  # broken reference, reported by report_image_refs()
+            storage_path = f"{STORAGE_PATH}/{ref}"
+            stat = file_path.stat()
+            entry = self.manifest["objects"].get(storage_path)
+            if manifest_unchanged(entry, stat):
+                self.counts["unchanged"] += 1
+                continue
+            future = self.executor.submit(self.upload, self.session, self.headers, file_path, storage_path,
+                                          (entry or {}).get("sha256"), self.manifest)
+            self.futures[future] = (ref, storage_path, stat)
+            future.add_done_callback(self.finished.append)
+        while self.finished:
+            self.collect([self.finished.popleft()])
+
+    def collect(self, finished):
+        for future in finished:
+            ref, storage_path, stat = self.futures.pop(future)
+            error = record_upload(self.manifest, self.counts, storage_path, stat, future)
+            if error:
+                self.failed[ref] = error
+            self.done += 1
+            if self.done % MANIFEST_SAVE_EVERY == 0:
+                save_manifest(self.manifest)
+
+    def finish(self):
+        try:
+            if self.futures:
+                print(f"\nWaiting for {len(self.futures)} uploads...")
+            # Everything still in self.futures, including what is queued in self.finished
+            self.collect(as_completed(list(self.futures)))
+        finally:
+            self.executor.shutdown()
+            self.session.close()
+            save_manifest(self.manifest)
+            if profiler is not None:
+                profiler.add_phase("upload images", time.perf_counter() - self.started)
+
+        print_upload_counts(self.counts)
+        if self.failed:
+            print(f"Failed uploads ({len(self.failed)}):")
+            for ref in sorted(self.failed)[:20]:
+                question_ids = ', '.join(str(q) for q in self.questions[ref][:10])
+                print(f"  {ref}: {self.failed[ref]} (questions {question_ids})")
+            if len(self.failed) > 20:
+                print(f"  ... and {len(self.failed) - 20} more")
+            affected = sorted({q for ref in self.failed for q in self.questions[ref]})
+            print(f"Questions with missing images ({len(affected)}): "
+                  f"{', '.join(map(str, affected[:50]))}{' ...' if len(affected) > 50 else ''}")
+
+
+def run_pipeline(files=None, workers=None, verify_remote=False, **convert_options):
+    """Convert and upload at the same time: each image referenced by a
+    converted question is uploaded right away, while parsing continues.
+    """
+    if files is None:
+        files = list_media_files()
+        if files is None:
+            return
+    uploader = PipelineUploader(files, workers=workers, verify_remote=verify_remote)
+    try:
+        convert_xml_to_json(referenced_only=True, media_files=files, on_question=uploader.add,
+                            **convert_options)
+    finally:
+        uploader.finish()
+
+
+def import_pillow():
+    """Return PIL.Image, or None when Pillow is not installed."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    return Image
+
+
+def optimized_dir():
+    """Where --optimize writes the optimized images and their variants."""
+    return os.path.join(os.path.dirname(OUTPUT_JSON), "d2l_optimized")
+
+
+def image_variants_path():
+    """Sidecar describing the objects --optimize produced for each image."""
+    return os.path.join(os.path.dirname(OUTPUT_JSON), "d2l_image_variants.json")
+
+
+def minify_svg(data):
+    """Drop comments and whitespace between tags from an SVG.
+
+    Whitespace between tags is meaningful inside <text>, so there it is only
+    collapsed to one space.
+    """
+    text = data.decode('utf-8')
+    text = re.sub(r'<!--.*?-->', '', text, flags=re.DOTALL)
+    if '<text' in text:
+        text = re.sub(r'>\s+<', '> <', text)
+    else:
+        text = re.sub(r'>\s+<', '><', text)
+    return text.strip().encode('utf-8')
+
+
+def encode_image(image, image_format, **options):
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def format_extension(ext, image_format):
+    """`ext` when it names `image_format`, else that format's usual extension."""
+    extensions = IMAGE_FORMAT_EXTENSIONS.get(image_format)
+    if not extensions or ext.lower() in extensions:
+        return ext
+    return extensions[0]
+
+
+def recompress_image(image):
+    """Re-encode a JPEG with its own quantization tables, anything else as lossless PNG.
+
+    Goes by the decoded format, not the file name: quality='keep' only
+    works on JPEG data, and exports contain PNGs saved as .jpg.
+    """
+    keep = {key: image.info[key] for key in ('icc_profile', 'exif') if image.info.get(key)}
+    if image.format != 'JPEG':
+        return encode_image(image, 'PNG', optimize=True, **keep)
+    return encode_image(image, 'JPEG', quality='keep', optimize=True, progressive=True, **keep)
+
+
+def optimize_image(source, out_dir, webp=False, max_dimension=None):
+    """Optimize one image into `out_dir`; runs in a worker process.
+
+    The optimized file keeps the original name and is only used when it is
+    smaller. With webp=True a <name>.webp variant is added when it beats the
+    optimized file, and with max_dimension a <stem>@<N><ext> rendition whose
+    longest side is at most N pixels; its extension follows the format it is
+    encoded in (a PNG saved as .jpg gives a .png rendition). GIF and WebP
+    sources are copied as is.
+    Returns {"original": bytes, "objects": {variant: (object name, bytes)}}.
+    """
+    with source.open('rb') as f:
+        data = f.read()
+    name = source.name
+    stem, ext = posixpath.splitext(name)
+    suffix = ext.lower()
+
+    image = None
+    optimized = data
+    if suffix == '.svg':
+        try:
+            optimized = min(data, minify_svg(data), key=len)
+        except UnicodeDecodeError:
+            pass
+    elif suffix in ('.png', '.jpg', '.jpeg'):
+        Image = import_pillow()
+        if Image is not None:
+            try:
+                image = Image.open(io.BytesIO(data))
+                image.load()
+                optimized = min(data, recompress_image(image), key=len)
+                optimized_format = image.format
+                if optimized is not data and image.format != 'JPEG':
+                    optimized_format = 'PNG'  # re-encoded by recompress_image()
+            except Exception:
+                image = None  # not decodable: upload the original bytes
+
+    objects = {}
+
+    def write(object_name, content, variant):
+        with open(os.path.join(out_dir, object_name), 'wb') as f:
+            f.write(content)
+        objects[variant] = (object_name, len(content))
+
+    write(name, optimized, 'optimized')
+
+    if webp and image is not None:
+        if image.format != 'JPEG':
+            webp_data = encode_image(image, 'WEBP', lossless=True)
         else:
-            errors += 1
-            print(f"  Error uploading {filename}: {resp.status_code} {resp.text[:200]}")
+            webp_data = encode_image(image, 'WEBP', quality=WEBP_QUALITY)
+        if len(webp_data) < len(optimized):
+            write(f"{name}.webp", webp_data, 'webp')
+
+    if max_dimension and image is not None:
+        capped, capped_format = optimized, optimized_format
+        if max(image.size) > max_dimension:
+            rendition = image.copy()
+            rendition.thumbnail((max_dimension, max_dimension))
+            if image.format != 'JPEG':
+                capped, capped_format = encode_image(rendition, 'PNG', optimize=True), 'PNG'
+            else:
+                capped = encode_image(rendition, 'JPEG', quality=CAPPED_JPEG_QUALITY, optimize=True,
+                                      progressive=True)
+                capped_format = 'JPEG'
+        write(f"{stem}@{max_dimension}{format_extension(ext, capped_format)}", capped, 'capped')
+
+    return {"original": len(data), "objects": objects}
+
+
+def optimize_images(files, jobs=None, webp=False, max_dimension=None):
+    """Optimize `files` on a process pool into optimized_dir().
+
+    Writes image_variants_path(), prints the bytes saved and returns the
+    optimized files (all variants) to upload in place of the originals. An
+    image that fails to optimize is uploaded as the original file.
+    """
+    if import_pillow() is None:
+        print("Warning: Pillow is not installed (pip install Pillow); only SVGs are minified")
+    out_dir = optimized_dir()
+    os.makedirs(out_dir, exist_ok=True)
+
+    images = {}
+    failed = []
+    with ProcessPoolExecutor(max_workers=jobs or os.cpu_count()) as executor:
+        futures = {executor.submit(optimize_image, f, out_dir, webp, max_dimension): f for f in files}
+        for future in as_completed(futures):
+            source = futures[future]
+            try:
+                images[source.name] = future.result()
+            except Exception as e:
+                print(f"  Error optimizing {source.name}, uploading the original: {e}")
+                failed.append(source)
+
+    with open(image_variants_path(), 'w', encoding='utf-8') as f:
+        json.dump({"images": images}, f, ensure_ascii=False, indent=2, sort_keys=True)
+
+    report_optimization(images)
+    return [Path(out_dir, object_name)
+            for result in images.values() for object_name, _ in result["objects"].values()] + failed
+
+
+def report_optimization(images):
+    """Print bytes saved by the optimized files and by each variant."""
+    original = sum(result["original"] for result in images.values())
+    print(f"\nOptimized {len(images)} images:")
+    for variant in IMAGE_VARIANTS:
+        results = [result for result in images.values() if variant in result["objects"]]
+        if not results:
+            continue
+        before = sum(result["original"] for result in results)
+        after = sum(result["objects"][variant][1] for result in results)
+        print(f"  {variant}: {len(results)} files, {before / 1024 / 1024:.1f} MB -> {after / 1024 / 1024:.1f} MB "
+              f"({(before - after) / before:.0%} saved)" if before else f"  {variant}: {len(results)} files")
+
+    savings = sorted(((result["original"] - result["objects"]["optimized"][1], name)
+                      for name, result in images.items()), reverse=True)
+    for saved, name in savings[:10]:
+        if saved > 0:
+            print(f"    {name}: -{saved / 1024:.0f} KB")
+    print(f"  Total originals: {original / 1024 / 1024:.1f} MB")
+
 
-        if (i + 1) % 20 == 0:
-            print(f"  Progress: {i + 1}/{len(files)} (uploaded: {uploaded}, skipped: {skipped}, errors: {errors})")
+def load_image_variants(variant):
+    """Point replace_image_urls() at `variant` of each optimized image.
 
-    print(f"\nUpload complete: {uploaded} uploaded, {skipped} already existed, {errors} errors")
+    Images without that variant (e.g. a WebP that was not smaller) keep their
+    optimized file under the original name.
+    """
+    global image_url_map
+    try:
+        with open(image_variants_path(), encoding='utf-8') as f:
+            images = json.load(f)["images"]
+    except FileNotFoundError:
+        print(f"Error: {image_variants_path()} not found, run --optimize first")
+        sys.exit(1)
+    image_url_map = {
+        normalize_media_name(name): result["objects"][variant][0]
+        for name, result in images.items()
+        if variant in result["objects"] and result["objects"][variant][0] != name
+    }
+    print(f"Image URLs point at the {variant} variant of {len(image_url_map)} images")
 
 
 def decode_html_text(text):
@@ -146,25 +1186,99 @@ def decode_html_text(text):
     return decoded
 
 
+# While convert_item() runs, every image filename rewritten by
+# replace_image_urls() is appended here
+collected_image_refs = None
+
+# Reference (normalize_media_name) -> object name to link instead (--image-variant)
+image_url_map = {}
+
+
+IMAGE_SRC_RE = re.compile(r'src="(data:image/[^";]+;base64,[^"]*|[^"]+\.(svg|png|jpg|jpeg|gif|webp))"', re.IGNORECASE)
+DATA_URI_EXTENSIONS = {'png': '.png', 'jpeg': '.jpg', 'jpg': '.jpg', 'gif': '.gif', 'webp': '.webp', 'svg+xml': '.svg'}
+DATA_URI_RE = re.compile(r'data:image/([\w.+-]+);base64,(.*)', re.IGNORECASE | re.DOTALL)
+
+
+def inline_images_dir():
+    """Images decoded from data: URIs, named by content hash."""
+    return os.path.join(os.path.dirname(OUTPUT_JSON), "d2l_inline_images")
+
+
+INLINE_IMAGE_RE = re.compile(r'inline-[0-9a-f]{32}\.[a-z]+')
+
+
+def inline_image_exists(ref):
+    """False only for an image extracted from a data: URI whose file is missing."""
+    return not INLINE_IMAGE_RE.fullmatch(ref) or (Path(inline_images_dir()) / ref).is_file()
+
+
+def list_inline_images():
+    folder = Path(inline_images_dir())
+    return sorted(folder.iterdir()) if folder.is_dir() else []
+
+
+def extract_data_uri(src):
+    """Save a base64 data: URI image as inline-<hash><ext>; return the file name.
+
+    <hash> is the SHA-256 of the decoded bytes truncated to 128 bits (32 hex
+    digits). Identical images get the same name and are written once. Returns None
+    for anything that is not a decodable image.
+    """
+    match = DATA_URI_RE.fullmatch(src)
+    if not match or match.group(1).lower() not in DATA_URI_EXTENSIONS:
+        return None
+    try:
+        data = base64.b64decode(match.group(2))
+    except ValueError:
+        return None
+    if not data:
+        return None
+    name = f"inline-{hashlib.sha256(data).hexdigest()[:32]}{DATA_URI_EXTENSIONS[match.group(1).lower()]}"
+    path = Path(inline_images_dir()) / name
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partial = path.with_name(f"{name}.{os.getpid()}.tmp")
+        partial.write_bytes(data)
+        os.replace(partial, path)
+    return name
+
+
 def replace_image_urls(html_text):
-    """Replace local image references with Supabase Storage URLs."""
+    """Replace local image references with Supabase Storage URLs.
+
+    Inline base64 images (src="data:image/...") are extracted to
+    inline_images_dir() and linked the same way, so they are uploaded once
+    instead of being copied into every row.
+    """
     if not html_text:
         return html_text
 
     def replace_src(match):
         src = match.group(1)
-        # Decode URL encoding (e.g., %20 -> space) for display, but keep encoded for URL
-        filename = urllib.parse.unquote(src)
+        if src[:5].lower() == 'data:':
+            filename = extract_data_uri(src)
+            if filename is None:
+                return match.group(0)
+        else:
+            # Decode URL encoding (e.g., %20 -> space) for display, but keep encoded for URL
+            filename = urllib.parse.unquote(src)
+        if image_url_map:
+            filename = image_url_map.get(normalize_media_name(filename), filename)
+        if collected_image_refs is not None:
+            collected_image_refs.append(filename)
         # Re-encode for the URL
         encoded_filename = urllib.parse.quote(filename)
         new_url = f"{BASE_IMAGE_URL}/{encoded_filename}"
         return f'src="{new_url}"'
 
-    # Replace src="filename.ext" with src="full_storage_url"
-    result = re.sub(r'src="([^"]+\.(svg|png|jpg|jpeg|gif|webp))"', replace_src, html_text, flags=re.IGNORECASE)
+    # Replace src="filename.ext" and src="data:image/..." with src="full_storage_url"
+    result = IMAGE_SRC_RE.sub(replace_src, html_text)
     return result
 
 
+IMG_SRC_RE = re.compile(r'<img\b[^>]*?\bsrc="([^"]*)"[^>]*>', re.IGNORECASE)
+
+
 def strip_html_tags(html_text):
     """Remove HTML tags to get plain text (for comparison/fallback)."""
     if not html_text:
@@ -173,6 +1287,139 @@ def strip_html_tags(html_text):
     return clean.strip()
 
 
+STREAM_TAGS = ('section', 'item')  # elements iter_items_streaming() needs events for
+
+
+class EtreeBackend:
+    """xml.etree.ElementTree, always available."""
+
+    name = 'etree'
+    find = staticmethod(ET.Element.find)
+    findall = staticmethod(ET.Element.findall)
+
+    @staticmethod
+    def parse(f):
+        return ET.parse(f).getroot()
+
+    @staticmethod
+    def iterparse(f):
+        """(event, element, parent) for the start and end of <section> and <item>."""
+        stack = []
+        for event, elem in ET.iterparse(f, events=('start', 'end')):
+            if event == 'start':
+                if elem.tag in STREAM_TAGS:
+                    yield event, elem, stack[-1] if stack else None
+                stack.append(elem)
+            else:
+                stack.pop()
+                if elem.tag in STREAM_TAGS:
+                    yield event, elem, stack[-1] if stack else None
+
+    @staticmethod
+    def fromstring(data):
+        return ET.fromstring(data)
+
+    @staticmethod
+    def tostring(element):
+        """Serialize without the tail (text after the end tag)."""
+        tail, element.tail = element.tail, None
+        try:
+            return ET.tostring(element)
+        finally:
+            element.tail = tail
+
+
+class LxmlBackend:
+    """lxml, with every path the parsers use compiled once.
+
+    One-step paths ('tag', './/tag') become lxml's C tag iterators and longer
+    ones precompiled XPath expressions; both are cheaper per call than
+    lxml's Python-level find(). Comments and processing instructions are
+    dropped while parsing, as ElementTree does, so both backends see the same
+    children.
+    """
+
+    name = 'lxml'
+
+    # Paths passed to find()/findall(); others are compiled on first use
+    PATHS = (
+        './/qti_metadatafield', 'fieldlabel', 'fieldentry',
+        './/resprocessing/respcondition', 'setvar', './/varequal', 'conditionvar', 'varequal',
+        './/flow_label', 'response_label', './/mattext', 'mattext', 'material/mattext',
+        './/response_lid', './/response_grp', './/response_label', './/presentation/flow',
+        './/section', 'item',
+    )
+
+    def __init__(self):
+        self.parser = lxml_etree.XMLParser(remove_comments=True, remove_pis=True, huge_tree=True)
+        self.first = {}
+        self.every = {}
+        for path in self.PATHS:
+            self.compile(path)
+
+    def compile(self, path):
+        if '/' not in path:
+            self.first[path] = lambda element: next(element.iterchildren(path), None)
+            self.every[path] = lambda element: list(element.iterchildren(path))
+        elif path.startswith('.//') and '/' not in path[3:]:
+            tag = path[3:]
+            self.first[path] = lambda element: next(element.iterdescendants(tag), None)
+            self.every[path] = lambda element: list(element.iterdescendants(tag))
+        else:
+            xpath = lxml_etree.XPath(path)
+            first = lxml_etree.XPath(f'({path})[1]')
+            self.first[path] = lambda element: next(iter(first(element)), None)
+            self.every[path] = xpath
+
+    def find(self, element, path):
+        if path not in self.first:
+            self.compile(path)
+        return self.first[path](element)
+
+    def findall(self, element, path):
+        if path not in self.every:
+            self.compile(path)
+        return self.every[path](element)
+
+    def parse(self, f):
+        return lxml_etree.parse(f, self.parser).getroot()
+
+    @staticmethod
+    def iterparse(f):
+        """(event, element, parent) for the start and end of <section> and <item>.
+
+        lxml filters the tags itself, so other elements cost no Python code.
+        """
+        for event, elem in lxml_etree.iterparse(f, events=('start', 'end'), tag=STREAM_TAGS,
+                                                remove_comments=True, remove_pis=True, huge_tree=True):
+            yield event, elem, elem.getparent()
+
+    def fromstring(self, data):
+        return lxml_etree.fromstring(data, self.parser)
+
+    @staticmethod
+    def tostring(element):
+        return lxml_etree.tostring(element, with_tail=False)
+
+
+XML_BACKENDS = {'etree': EtreeBackend, 'lxml': LxmlBackend}
+
+
+def set_xml_backend(name):
+    """Select the XML backend used for parsing and for find()/findall()."""
+    global xml_backend, find, findall
+    if name == 'lxml' and lxml_etree is None:
+        print("Warning: lxml is not installed, using ElementTree")
+        name = 'etree'
+    xml_backend = XML_BACKENDS[name]()
+    find = xml_backend.find
+    findall = xml_backend.findall
+
+
+xml_backend = find = findall = None
+set_xml_backend(XML_BACKEND)
+
+
 def get_text_from_mattext(element):
     """Extract text content from a mattext element, preserving HTML."""
     if element is None:
@@ -189,53 +1436,120 @@ def get_text_from_mattext(element):
 
 def get_question_type(item):
     """Extract question type from item metadata."""
-    for field in item.findall('.//qti_metadatafield'):
-        label = field.find('fieldlabel')
-        entry = field.find('fieldentry')
+    for field in findall(item, './/qti_metadatafield'):
+        label = find(field, 'fieldlabel')
+        entry = find(field, 'fieldentry')
         if label is not None and label.text == 'qmd_questiontype':
             return entry.text if entry is not None else None
     return None
 
 
-def parse_multiple_choice(item, flow):
-    """Parse a Multiple Choice question."""
-    # Get question text
-    material = flow.find('material/mattext')
-    question_text = get_text_from_mattext(material)
+class ItemIndex:
+    """Per-item lookup tables over <resprocessing>, built in one pass.
 
-    # Get options
-    response_lid = flow.find('.//response_lid')
-    if response_lid is None:
-        return None
+    Every parser used to rescan all respconditions (once per blank or per
+    matching group), which is quadratic on large items. Each entry of
+    `conditions` is (respcondition, setvar, score, varequal) in document
+    order, where setvar is the direct <setvar> child, varequal the first
+    <varequal> descendant and score the setvar value as a float (0 when
+    missing or invalid).
+    """
 
-    options = []
-    option_idents = []
+    def __init__(self, item):
+        self.conditions = []
+        self.positive = []          # conditions with setvar and score > 0
+        self.by_respident = {}      # varequal respident -> conditions
+        self.first_positive = {}    # varequal respident -> first positive varequal text
+        self.positive_texts = {}    # varequal respident -> every varequal a positive condition accepts
 
-    for flow_label in response_lid.findall('.//flow_label'):
-        resp_label = flow_label.find('response_label')
-        if resp_label is not None:
-            ident = resp_label.get('ident')
-            mattext = resp_label.find('.//mattext')
-            option_text = get_text_from_mattext(mattext)
-            options.append(option_text)
-            option_idents.append(ident)
+        for respcondition in findall(item, './/resprocessing/respcondition'):
+            setvar = find(respcondition, 'setvar')
+            score = 0
+            if setvar is not None:
+                try:
+                    score = float(setvar.text)
+                except (ValueError, TypeError):
+                    score = 0
+            varequal = find(respcondition, './/varequal')
+            condition = (respcondition, setvar, score, varequal)
+
+            self.conditions.append(condition)
+            if setvar is not None and score > 0:
+                self.positive.append(condition)
+            if varequal is not None:
+                respident = varequal.get('respident')
+                self.by_respident.setdefault(respident, []).append(condition)
+                if setvar is not None and score > 0:
+                    self.first_positive.setdefault(respident, varequal.text)
+            if setvar is not None and score > 0:
+                for accepted in accepted_varequals(find(respcondition, 'conditionvar')):
+                    self.positive_texts.setdefault(accepted.get('respident'), []).append(accepted.text)
+
+
+def accepted_varequals(conditionvar):
+    """Every <varequal> a condition matches on, <or> alternatives included
+    and <not> branches skipped."""
+    if conditionvar is None:
+        return
+    for child in conditionvar:
+        if child.tag == 'varequal':
+            yield child
+        elif child.tag != 'not':
+            yield from accepted_varequals(child)
 
-    # Get correct answer from resprocessing
-    correct_answers = []
-    for respcondition in item.findall('.//resprocessing/respcondition'):
-        setvar = respcondition.find('setvar')
-        if setvar is not None:
-            try:
-                score = float(setvar.text)
-            except (ValueError, TypeError):
-                score = 0
-            if score > 0:
-                varequal = respcondition.find('.//varequal')
-                if varequal is not None and varequal.text:
-                    correct_ident = varequal.text
-                    if correct_ident in option_idents:
-                        idx = option_idents.index(correct_ident)
-                        correct_answers.append(options[idx])
+
+def normalize_answer(text):
+    """Comparable form of an accepted answer: entities decoded, tags
+    stripped, whitespace collapsed, NFC and lower-cased.
+
+    normalizeAnswer() in src/services/gradingService.ts is the same
+    function for the student's answer; keep the two in sync.
+    """
+    text = html.unescape(strip_html_tags(html.unescape(text or "")))
+    return unicodedata.normalize('NFC', ' '.join(text.split())).lower()
+
+
+def answer_key(texts):
+    """Distinct normalized variants of one blank's accepted answers, in order."""
+    return list(dict.fromkeys(key for key in map(normalize_answer, texts) if key))
+
+
+def read_choice_options(response_lid):
+    """Return (option texts, ident -> position of its first option)."""
+    options = []
+    positions = {}
+    for flow_label in findall(response_lid, './/flow_label'):
+        resp_label = find(flow_label, 'response_label')
+        if resp_label is not None:
+            ident = resp_label.get('ident')
+            mattext = find(resp_label, './/mattext')
+            positions.setdefault(ident, len(options))
+            options.append(get_text_from_mattext(mattext))
+    return options, positions
+
+
+def parse_multiple_choice(item, flow, index=None):
+    """Parse a Multiple Choice question."""
+    index = index or ItemIndex(item)
+
+    # Get question text
+    material = find(flow, 'material/mattext')
+    question_text = get_text_from_mattext(material)
+
+    # Get options
+    response_lid = find(flow, './/response_lid')
+    if response_lid is None:
+        return None
+
+    options, positions = read_choice_options(response_lid)
+
+    # Get correct answer from resprocessing
+    correct_answers = []
+    for _, _, _, varequal in index.positive:
+        if varequal is not None and varequal.text:
+            correct_ident = varequal.text
+            if correct_ident in positions:
+                correct_answers.append(options[positions[correct_ident]])
 
     return {
         "question": question_text,
@@ -244,55 +1558,36 @@ def parse_multiple_choice(item, flow):
     }
 
 
-def parse_multi_select(item, flow):
+def parse_multi_select(item, flow, index=None):
     """Parse a Multi-Select question (multiple correct answers required).
 
     D2L structure: the positive-score respcondition has a conditionvar with
     direct <varequal> children = options that MUST be selected (correct).
     Options inside <not><varequal> must NOT be selected (incorrect, ignored here).
     """
-    material = flow.find('material/mattext')
+    index = index or ItemIndex(item)
+
+    material = find(flow, 'material/mattext')
     question_text = get_text_from_mattext(material)
 
-    response_lid = flow.find('.//response_lid')
+    response_lid = find(flow, './/response_lid')
     if response_lid is None:
         return None
 
-    options = []
-    option_idents = []
-    for flow_label in response_lid.findall('.//flow_label'):
-        resp_label = flow_label.find('response_label')
-        if resp_label is not None:
-            ident = resp_label.get('ident')
-            mattext = resp_label.find('.//mattext')
-            option_text = get_text_from_mattext(mattext)
-            options.append(option_text)
-            option_idents.append(ident)
+    options, positions = read_choice_options(response_lid)
 
-    # Find the respcondition with a positive score
+    # Only the first positive-scoring condition describes the correct set
     correct_answers = []
-    for respcondition in item.findall('.//resprocessing/respcondition'):
-        setvar = respcondition.find('setvar')
-        if setvar is None:
-            continue
-        try:
-            score = float(setvar.text)
-        except (ValueError, TypeError):
-            score = 0
-        if score <= 0:
-            continue
-
-        # Found the positive-scoring condition
+    if index.positive:
+        respcondition = index.positive[0][0]
         # Direct <varequal> children of <conditionvar> = must select (correct)
         # <varequal> inside <not> = must NOT select (skip)
-        conditionvar = respcondition.find('conditionvar')
+        conditionvar = find(respcondition, 'conditionvar')
         if conditionvar is not None:
-            for varequal in conditionvar.findall('varequal'):
+            for varequal in findall(conditionvar, 'varequal'):
                 ident = varequal.text
-                if ident and ident in option_idents:
-                    idx = option_idents.index(ident)
-                    correct_answers.append(options[idx])
-        break  # Only process first positive-scoring condition
+                if ident and ident in positions:
+                    correct_answers.append(options[positions[ident]])
 
     return {
         "question": question_text,
@@ -301,40 +1596,24 @@ def parse_multi_select(item, flow):
     }
 
 
-def parse_true_false(item, flow):
+def parse_true_false(item, flow, index=None):
     """Parse a True/False question."""
-    material = flow.find('material/mattext')
+    index = index or ItemIndex(item)
+
+    material = find(flow, 'material/mattext')
     question_text = get_text_from_mattext(material)
 
-    response_lid = flow.find('.//response_lid')
+    response_lid = find(flow, './/response_lid')
     if response_lid is None:
         return None
 
-    option_idents = []
-    options_text = []
-    for flow_label in response_lid.findall('.//flow_label'):
-        resp_label = flow_label.find('response_label')
-        if resp_label is not None:
-            ident = resp_label.get('ident')
-            mattext = resp_label.find('.//mattext')
-            text = get_text_from_mattext(mattext)
-            option_idents.append(ident)
-            options_text.append(text)
+    options_text, positions = read_choice_options(response_lid)
 
     # Find correct answer
     correct_answers = []
-    for respcondition in item.findall('.//resprocessing/respcondition'):
-        setvar = respcondition.find('setvar')
-        if setvar is not None:
-            try:
-                score = float(setvar.text)
-            except (ValueError, TypeError):
-                score = 0
-            if score > 0:
-                varequal = respcondition.find('.//varequal')
-                if varequal is not None and varequal.text in option_idents:
-                    idx = option_idents.index(varequal.text)
-                    correct_answers.append(options_text[idx])
+    for _, _, _, varequal in index.positive:
+        if varequal is not None and varequal.text in positions:
+            correct_answers.append(options_text[positions[varequal.text]])
 
     return {
         "question": question_text,
@@ -343,8 +1622,10 @@ def parse_true_false(item, flow):
     }
 
 
-def parse_fill_blank(item, flow):
+def parse_fill_blank(item, flow, index=None):
     """Parse a Fill in the Blanks question."""
+    index = index or ItemIndex(item)
+
     # FIB questions have alternating material and response_str elements
     parts = []
     blanks_idents = []
@@ -352,13 +1633,13 @@ def parse_fill_blank(item, flow):
     for child in flow:
         tag = child.tag.split('}')[-1] if '}' in child.tag else child.tag
         if tag == 'material':
-            mattext = child.find('mattext')
+            mattext = find(child, 'mattext')
             text = get_text_from_mattext(mattext)
             parts.append(text)
         elif tag == 'response_str':
             ident = child.get('ident', '')
             # Find the answer label ident
-            answer_label = child.find('.//response_label')
+            answer_label = find(child, './/response_label')
             if answer_label is not None:
                 blanks_idents.append(answer_label.get('ident', ''))
             else:
@@ -369,76 +1650,58 @@ def parse_fill_blank(item, flow):
 
     question_text = ''.join(parts)
 
-    # Get correct answers from resprocessing
-    correct_answers = []
-    for blank_ident in blanks_idents:
-        # Find the first correct answer for this blank
-        found = False
-        for respcondition in item.findall('.//resprocessing/respcondition'):
-            setvar = respcondition.find('setvar')
-            if setvar is not None:
-                try:
-                    score = float(setvar.text)
-                except (ValueError, TypeError):
-                    score = 0
-                if score > 0:
-                    varequal = respcondition.find('.//varequal')
-                    if varequal is not None and varequal.get('respident') == blank_ident:
-                        correct_answers.append(varequal.text)
-                        found = True
-                        break
-        if not found:
-            correct_answers.append("")
+    # First correct answer of each blank, "" when there is none
+    correct_answers = [index.first_positive.get(blank_ident, "") for blank_ident in blanks_idents]
 
-    return {
+    result = {
         "question": question_text,
         "correct_answers": correct_answers,
     }
+    if ANSWER_KEYS:
+        # Every variant D2L accepts for each blank, not only the first
+        result["answer_keys"] = [answer_key(index.positive_texts.get(blank_ident, ()))
+                                 for blank_ident in blanks_idents]
+    return result
 
 
-def parse_matching(item, flow):
+def parse_matching(item, flow, index=None):
     """Parse a Matching question."""
-    material = flow.find('material/mattext')
+    index = index or ItemIndex(item)
+
+    material = find(flow, 'material/mattext')
     question_text = get_text_from_mattext(material)
 
     matching_pairs = []
 
     # Each response_grp is a premise (term) with choices (definitions)
-    for resp_grp in flow.findall('.//response_grp'):
+    for resp_grp in findall(flow, './/response_grp'):
         grp_ident = resp_grp.get('respident', '')
 
         # Get the premise (term) text
-        premise_mattext = resp_grp.find('material/mattext')
+        premise_mattext = find(resp_grp, 'material/mattext')
         premise = get_text_from_mattext(premise_mattext)
 
         # Get all possible responses (definitions)
         response_map = {}
-        for resp_label in resp_grp.findall('.//response_label'):
+        for resp_label in findall(resp_grp, './/response_label'):
             ident = resp_label.get('ident')
-            mattext = resp_label.find('.//mattext')
+            mattext = find(resp_label, './/mattext')
             text = get_text_from_mattext(mattext)
             response_map[ident] = text
 
         # Find the correct response for this group
         correct_response = ""
-        for respcondition in item.findall('.//resprocessing/respcondition'):
-            varequal = respcondition.find('.//varequal')
-            if varequal is not None and varequal.get('respident') == grp_ident:
-                setvar = respcondition.find('setvar')
-                if setvar is not None:
-                    varname = setvar.get('varname', '')
-                    action = setvar.get('action', '')
-                    try:
-                        val = float(setvar.text) if setvar.text else 0
-                    except ValueError:
-                        val = 0
-
-                    # D2L_Correct with Add action = correct answer
-                    if (varname == 'D2L_Correct' and action == 'Add') or (val > 0 and varname != 'D2L_Incorrect'):
-                        answer_ident = varequal.text
-                        if answer_ident in response_map:
-                            correct_response = response_map[answer_ident]
-                            break
+        for _, setvar, val, varequal in index.by_respident.get(grp_ident, ()):
+            if setvar is not None:
+                varname = setvar.get('varname', '')
+                action = setvar.get('action', '')
+
+                # D2L_Correct with Add action = correct answer
+                if (varname == 'D2L_Correct' and action == 'Add') or (val > 0 and varname != 'D2L_Incorrect'):
+                    answer_ident = varequal.text
+                    if answer_ident in response_map:
+                        correct_response = response_map[answer_ident]
+                        break
 
         matching_pairs.append({
             "premise": premise,
@@ -451,28 +1714,28 @@ def parse_matching(item, flow):
     }
 
 
-def parse_ordering(item, flow):
+def parse_ordering(item, flow, index=None):
     """Parse an Ordering question."""
-    material = flow.find('material/mattext')
+    index = index or ItemIndex(item)
+
+    material = find(flow, 'material/mattext')
     question_text = get_text_from_mattext(material)
 
     # Get all items in the ordering
-    resp_grp = flow.find('.//response_grp')
+    resp_grp = find(flow, './/response_grp')
     if resp_grp is None:
         return None
 
     items_map = {}  # ident -> text
-    for resp_label in resp_grp.findall('.//response_label'):
+    for resp_label in findall(resp_grp, './/response_label'):
         ident = resp_label.get('ident')
-        mattext = resp_label.find('.//mattext')
+        mattext = find(resp_label, './/mattext')
         text = get_text_from_mattext(mattext)
         items_map[ident] = text
 
     # Get correct order from resprocessing
     order_map = {}  # position -> ident
-    for respcondition in item.findall('.//resprocessing/respcondition'):
-        setvar = respcondition.find('setvar')
-        varequal = respcondition.find('.//varequal')
+    for _, setvar, _, varequal in index.conditions:
         if setvar is not None and varequal is not None:
             varname = setvar.get('varname', '')
             if varname == 'D2L_Correct':
@@ -496,122 +1759,2056 @@ def parse_ordering(item, flow):
     }
 
 
-def parse_short_answer(item, flow):
+def parse_short_answer(item, flow, index=None):
     """Parse a Short Answer question."""
-    material = flow.find('material/mattext')
+    index = index or ItemIndex(item)
+
+    material = find(flow, 'material/mattext')
     question_text = get_text_from_mattext(material)
 
     correct_answers = []
-    for respcondition in item.findall('.//resprocessing/respcondition'):
-        setvar = respcondition.find('setvar')
-        if setvar is not None:
-            try:
-                score = float(setvar.text)
-            except (ValueError, TypeError):
-                score = 0
-            if score > 0:
-                varequal = respcondition.find('.//varequal')
-                if varequal is not None and varequal.text:
-                    correct_answers.append(varequal.text)
+    for _, _, _, varequal in index.positive:
+        if varequal is not None and varequal.text:
+            correct_answers.append(varequal.text)
 
-    return {
+    result = {
         "question": question_text,
         "correct_answers": correct_answers,
     }
+    if ANSWER_KEYS:
+        result["answer_keys"] = [answer_key(text for texts in index.positive_texts.values() for text in texts)]
+    return result
 
 
-def convert_xml_to_json():
-    """Parse D2L XML and convert to JSON format compatible with importService.ts."""
-    print(f"Parsing XML: {XML_PATH}")
-    tree = ET.parse(XML_PATH)
-    root = tree.getroot()
+PARSERS = {
+    'Multiple Choice': parse_multiple_choice,
+    'Multi-Select': parse_multi_select,
+    'True/False': parse_true_false,
+    'Fill in the Blanks': parse_fill_blank,
+    'Matching': parse_matching,
+    'Ordering': parse_ordering,
+    'Short Answer': parse_short_answer,
+}
 
-    questions = []
-    question_id = 0
-    errors = []
 
-    for section in root.findall('.//section'):
+def convert_item(item, question_id, section_title):
+    """Convert one <item> element.
+
+    Returns (question_data, error, image_refs): one of question_data and error
+    is None, and image_refs lists the image filenames the question references.
+    """
+    global collected_image_refs
+    collected_image_refs = image_refs = []
+    try:
+        question_data, error = parse_item(item, question_id, section_title)
+    finally:
+        collected_image_refs = None
+    return question_data, error, image_refs
+
+
+def parse_item(item, question_id, section_title):
+    """Dispatch one <item> to its parser. Returns (question_data, error)."""
+    q_type = get_question_type(item)
+
+    if not q_type:
+        return None, f"Question {question_id}: No type found"
+
+    flow = find(item, './/presentation/flow')
+    if flow is None:
+        return None, f"Question {question_id}: No presentation/flow found"
+
+    try:
+        parser = PARSERS.get(q_type)
+        if parser is None:
+            return None, f"Question {question_id}: Unknown type '{q_type}'"
+
+        result = parser(item, flow, ItemIndex(item))
+        if result is None:
+            return None, f"Question {question_id}: Failed to parse ({q_type})"
+
+        question_data = {
+            "id": question_id,
+            "section": section_title,
+            "type": q_type,
+            **result,
+        }
+        return question_data, None
+
+    except Exception as e:
+        return None, f"Question {question_id} ({q_type}): {str(e)}"
+
+
+def open_xml(source):
+    """Open an XML source for binary reading: a path, Path or ZipMember."""
+    if hasattr(source, 'open'):
+        return source.open('rb')
+    return open(source, 'rb')
+
+
+def iter_items_tree(xml_path):
+    """Yield (question_id, section_title, item) from a fully parsed XML tree."""
+    print(f"Parsing XML: {xml_path}")
+    with open_xml(xml_path) as f:
+        root = xml_backend.parse(f)
+
+    question_id = 0
+    for section in findall(root, './/section'):
         section_title = section.get('title', 'Sin sección')
-        items = section.findall('item')
+        items = findall(section, 'item')
         print(f"  Section: {section_title} ({len(items)} questions)")
 
         for item in items:
             question_id += 1
-            q_type = get_question_type(item)
+            yield question_id, section_title, item
+
 
-            if not q_type:
-                errors.append(f"Question {question_id}: No type found")
+def scan_section_counts(xml_path):
+    """Cheap pre-pass: list of (section_title, item_count) in document order.
+
+    Uses a bare expat parser so no tree is built. Only <item> elements that are
+    direct children of a <section> are counted, like section.findall('item').
+    """
+    sections = []
+    open_sections = []  # (index into sections, depth), innermost last
+    stack = []
+
+    def start(tag, attrs):
+        if tag == 'section' and stack:
+            open_sections.append((len(sections), len(stack)))
+            sections.append([attrs.get('title', 'Sin sección'), 0])
+        elif tag == 'item' and open_sections and open_sections[-1][1] == len(stack) - 1:
+            sections[open_sections[-1][0]][1] += 1
+        stack.append(tag)
+
+    def end(tag):
+        stack.pop()
+        if open_sections and open_sections[-1][1] == len(stack):
+            open_sections.pop()
+
+    parser = expat.ParserCreate(namespace_separator='}')
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    with open_xml(xml_path) as f:
+        parser.ParseFile(f)
+
+    return [(title, count) for title, count in sections]
+
+
+def scan_export(xml_path=None):
+    """Summarize an export from its metadata only (--scan).
+
+    One expat pass reads section titles, qmd_questiontype and the image
+    references in mattext; no tree is built and no HTML is decoded or
+    parsed into answers. Prints the same per-type summary as a conversion.
+    Items that would fail to convert for a missing type, presentation or
+    unknown type are listed as errors; answer-level failures only show up
+    in a real conversion.
+    """
+    xml_path = xml_path or XML_PATH
+    start = time.perf_counter()
+    print(f"Scanning XML: {xml_path}")
+
+    stats = ConversionStats()
+    sections = []       # [title, item count]
+    item_errors = []    # (section index, position in section, message)
+    image_refs = Counter()
+    open_sections = []  # (index into sections, depth), innermost last
+    stack = []
+    text = []           # character data of the open fieldlabel/fieldentry/mattext
+    item = None         # state of the <item> being read
+
+    def start_element(tag, attrs):
+        nonlocal item
+        if tag == 'section' and stack:
+            open_sections.append((len(sections), len(stack)))
+            sections.append([attrs.get('title', 'Sin sección'), 0])
+        elif tag == 'item' and open_sections and open_sections[-1][1] == len(stack) - 1:
+            section = sections[open_sections[-1][0]]
+            item = {"section": open_sections[-1][0], "position": section[1], "depth": len(stack),
+                    "type": None, "label": None, "flow": False, "image": False}
+            section[1] += 1
+        elif item is not None:
+            if tag == 'flow' and stack[-1] == 'presentation':
+                item["flow"] = True
+            elif tag in ('fieldlabel', 'fieldentry', 'mattext'):
+                text.clear()
+        stack.append(tag)
+
+    def characters(data):
+        if item is not None and stack[-1] in ('fieldlabel', 'fieldentry', 'mattext'):
+            text.append(data)
+
+    def end_element(tag):
+        nonlocal item
+        stack.pop()
+        if open_sections and open_sections[-1][1] == len(stack):
+            open_sections.pop()
+        if item is None:
+            return
+        if tag == 'fieldlabel':
+            item["label"] = ''.join(text)
+        elif tag == 'fieldentry' and item["label"] == 'qmd_questiontype' and item["type"] is None:
+            item["type"] = ''.join(text)
+        elif tag == 'mattext':
+            content = ''.join(text)
+            if '&' in content:
+                content = html.unescape(content)
+            refs = [urllib.parse.unquote(m.group(1)) if m.group(1)[:5].lower() != 'data:' else 'data:'
+                    for m in IMAGE_SRC_RE.finditer(content)]
+            image_refs.update(refs)
+            # Same rule as ConversionStats: images in the question text or in choice options
+            in_question = stack[-1] == 'material' and stack[-2] == 'flow'
+            in_options = 'response_lid' in stack and item["type"] in ('Multiple Choice', 'Multi-Select')
+            if (in_question or in_options) and '<img' in content:
+                item["image"] = True
+        elif tag == 'item' and len(stack) == item["depth"]:
+            if not item["type"]:
+                error = "No type found"
+            elif not item["flow"]:
+                error = "No presentation/flow found"
+            elif item["type"] not in PARSERS:
+                error = f"Unknown type '{item['type']}'"
+            else:
+                error = None
+                stats.add({"type": item["type"], "question": "<img" if item["image"] else ""})
+            if error:
+                item_errors.append((item["section"], item["position"], error))
+            item = None
+
+    parser = expat.ParserCreate(namespace_separator='}')
+    parser.buffer_text = True
+    parser.StartElementHandler = start_element
+    parser.CharacterDataHandler = characters
+    parser.EndElementHandler = end_element
+    with open_xml(xml_path) as f:
+        parser.ParseFile(f)
+
+    # Question ids number the items section by section, like iter_items_tree()
+    first_ids = []
+    next_id = 1
+    for title, count in sections:
+        print(f"  Section: {title} ({count} questions)")
+        first_ids.append(next_id)
+        next_id += count
+    stats.errors = [f"Question {first_ids[section] + position}: {error}"
+                    for section, position, error in sorted(item_errors)]
+
+    stats.print_summary()
+    inline = image_refs.pop('data:', 0)
+    print(f"Image references: {sum(image_refs.values())} to {len(image_refs)} files"
+          f"{f', {inline} inline data: URIs' if inline else ''}")
+    print(f"Scanned {next_id - 1} items in {time.perf_counter() - start:.2f}s")
+    return stats
+
+
+def iter_items_streaming(xml_path):
+    """Yield (question_id, section_title, item) while parsing incrementally.
+
+    Question ids follow the same section order as iter_items_tree(), so they
+    only arrive out of order when a section has items after a nested section.
+    Each item is cleared and detached once the consumer resumes the generator.
+    """
+    print(f"Streaming XML: {xml_path}")
+    sections = scan_section_counts(xml_path)
+
+    # First question id of every section, in document order
+    first_ids = []
+    next_id = 1
+    for _, count in sections:
+        first_ids.append(next_id)
+        next_id += count
+
+    open_sections = []  # [element, title, next question id], innermost last
+    section_index = 0
+
+    with open_xml(xml_path) as f:
+        for event, elem, parent in xml_backend.iterparse(f):
+            if event == 'start':
+                if elem.tag == 'section' and parent is not None:
+                    title, count = sections[section_index]
+                    print(f"  Section: {title} ({count} questions)")
+                    open_sections.append([elem, title, first_ids[section_index]])
+                    section_index += 1
                 continue
 
-            flow = item.find('.//presentation/flow')
-            if flow is None:
-                errors.append(f"Question {question_id}: No presentation/flow found")
+            if elem.tag == 'item' and open_sections and parent is open_sections[-1][0]:
+                current = open_sections[-1]
+                yield current[2], current[1], elem
+                current[2] += 1
+                elem.clear()
+                parent.remove(elem)
+            elif open_sections and elem is open_sections[-1][0]:
+                open_sections.pop()
+                elem.clear()
+                parent.remove(elem)
+            elif elem.tag == 'item' and parent is not None:
+                # Items outside a section are ignored, same as the tree mode
+                elem.clear()
+                parent.remove(elem)
+
+
+def in_id_order(results):
+    """Re-sequence result tuples by their first field, the question_id.
+
+    Out-of-order results wait in a small buffer until the gap before them is
+    filled; in-order input passes straight through.
+    """
+    pending = {}
+    expected = 1
+    for result in results:
+        pending[result[0]] = result
+        while expected in pending:
+            yield pending.pop(expected)
+            expected += 1
+    for question_id in sorted(pending):
+        yield pending[question_id]
+
+
+def worker_config():
+    """Module settings that conversion workers must share with the parent.
+
+    Worker processes may be spawned (fresh interpreter) rather than forked,
+    so anything changed at runtime is passed to them explicitly.
+    """
+    return {
+        "BASE_IMAGE_URL": BASE_IMAGE_URL,
+        "OUTPUT_JSON": OUTPUT_JSON,
+        "ANSWER_KEYS": ANSWER_KEYS,
+        "XML_BACKEND": xml_backend.name,
+        "image_url_map": image_url_map,
+    }
+
+
+def configure_worker(config):
+    """Process pool initializer: apply the parent's settings."""
+    globals().update(config)
+    set_xml_backend(XML_BACKEND)
+
+
+def convert_batch(batch):
+    """Convert serialized items in a worker process.
+
+    `batch` is a list of (question_id, section_title, item_xml); returns a list
+    of (question_id, question_data, error, image_refs) in the same order.
+    """
+    results = []
+    for question_id, section_title, item_xml in batch:
+        item = xml_backend.fromstring(item_xml)
+        results.append((question_id, *convert_item(item, question_id, section_title)))
+    return results
+
+
+class ParseCache:
+    """On-disk cache of converted items, keyed by item ident and XML hash.
+
+    Entries are also scoped to CONVERTER_VERSION, BASE_IMAGE_URL and the
+    --image-variant mapping, which all end up inside the converted HTML;
+    entries from another converter version are dropped on open. Only
+    successful conversions are stored, without their position-dependent id
+    and section.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or PARSE_CACHE
+        # --zip --jobs N converts archives in parallel processes on one cache
+        self.db = sqlite3.connect(self.path, timeout=60)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS items ("
+            " key TEXT, config TEXT, version INTEGER, value TEXT, size INTEGER, last_used REAL,"
+            " PRIMARY KEY (key, config))"
+        )
+        self.db.execute("DELETE FROM items WHERE version != ?", (CONVERTER_VERSION,))
+        self.db.commit()
+        config = f"{CONVERTER_VERSION}|{BASE_IMAGE_URL}|{json.dumps(image_url_map, sort_keys=True)}|{ANSWER_KEYS}"
+        self.config = hashlib.sha256(config.encode('utf-8')).hexdigest()[:16]
+        self.hits = 0
+        self.misses = 0
+        self.used = []
+        self.pending = 0
+
+    @staticmethod
+    def item_key(item):
+        digest = hashlib.sha256(xml_backend.tostring(item)).hexdigest()
+        return f"{item.get('ident', '')}:{digest}"
+
+    def get(self, key):
+        """(question_data without id/section, image_refs) or None."""
+        row = self.db.execute("SELECT value FROM items WHERE key = ? AND config = ?",
+                              (key, self.config)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        value = json.loads(row[0])
+        if not all(inline_image_exists(ref) for ref in value["image_refs"]):
+            # Converting again writes the data: URI images back to inline_images_dir()
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.used.append(key)
+        if len(self.used) >= FLUSH_EVERY:
+            self.touch()
+        return value["question"], value["image_refs"]
+
+    def put(self, key, question_data, image_refs):
+        question = {k: v for k, v in question_data.items() if k not in ('id', 'section')}
+        value = json.dumps({"question": question, "image_refs": image_refs}, ensure_ascii=False)
+        self.db.execute("INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?, ?)",
+                        (key, self.config, CONVERTER_VERSION, value, len(value), time.time()))
+        # Short write transactions so other processes are not locked out
+        self.pending += 1
+        if self.pending >= FLUSH_EVERY:
+            self.db.commit()
+            self.pending = 0
+
+    def touch(self):
+        """Record the hits since the last call as recently used."""
+        now = time.time()
+        self.db.executemany("UPDATE items SET last_used = ? WHERE key = ? AND config = ?",
+                            [(now, key, self.config) for key in self.used])
+        self.db.commit()
+        self.used = []
+
+    def close(self):
+        """Record hits, evict down to PARSE_CACHE_MAX_BYTES and commit."""
+        self.touch()
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM items").fetchone()[0]
+        if total > PARSE_CACHE_MAX_BYTES:
+            # Evict to 90% so the next run does not evict again right away
+            excess = total - PARSE_CACHE_MAX_BYTES * 9 // 10
+            evicted = []
+            for rowid, size in self.db.execute("SELECT rowid, size FROM items ORDER BY last_used"):
+                if excess <= 0:
+                    break
+                evicted.append((rowid,))
+                excess -= size
+            self.db.executemany("DELETE FROM items WHERE rowid = ?", evicted)
+            print(f"Parse cache: evicted {len(evicted)} items")
+        self.db.commit()
+        self.db.close()
+        print(f"Parse cache: {self.hits} hits, {self.misses} converted")
+
+
+def convert_parallel(records, jobs):
+    """Convert (question_id, section_title, item) records on `jobs` processes.
+
+    Items are serialized in batches of JOBS_BATCH_SIZE and at most
+    jobs * JOBS_QUEUE_DEPTH batches are in flight, so streamed input stays
+    bounded. Results are yielded in submission order. A None record is
+    passed straight through as a None result (see convert_xml_to_json).
+    """
+    def batches():
+        batch = []
+        for record in records:
+            if record is None:
+                yield None
+                continue
+            question_id, section_title, item = record
+            batch.append((question_id, section_title, xml_backend.tostring(item)))
+            if len(batch) == JOBS_BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=configure_worker,
+                             initargs=(worker_config(),)) as executor:
+        in_flight = deque()
+        for batch in batches():
+            if batch is None:
+                yield None
                 continue
+            in_flight.append(executor.submit(convert_batch, batch))
+            if len(in_flight) >= jobs * JOBS_QUEUE_DEPTH:
+                yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
 
-            try:
-                result = None
-
-                if q_type == 'Multiple Choice':
-                    result = parse_multiple_choice(item, flow)
-                elif q_type == 'Multi-Select':
-                    result = parse_multi_select(item, flow)
-                elif q_type == 'True/False':
-                    result = parse_true_false(item, flow)
-                elif q_type == 'Fill in the Blanks':
-                    result = parse_fill_blank(item, flow)
-                elif q_type == 'Matching':
-                    result = parse_matching(item, flow)
-                elif q_type == 'Ordering':
-                    result = parse_ordering(item, flow)
-                elif q_type == 'Short Answer':
-                    result = parse_short_answer(item, flow)
+
+class JsonArrayWriter:
+    """Write questions as a JSON array, byte-identical to json.dump(indent=2).
+
+    Questions are written as they arrive, so the full list is never held in
+    memory and importService.ts can read the result unchanged.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.f = open(path, 'w', encoding='utf-8')
+        self.count = 0
+
+    def write(self, question):
+        self.f.write('[\n  ' if self.count == 0 else ',\n  ')
+        self.f.write(json.dumps(question, ensure_ascii=False, indent=2).replace('\n', '\n  '))
+        self.count += 1
+        if self.count % FLUSH_EVERY == 0:
+            self.f.flush()
+
+    def close(self):
+        self.f.write('\n]' if self.count else '[]')
+        self.f.close()
+
+
+class NdjsonWriter:
+    """Write one compact JSON question per line.
+
+    Every flushed line is a complete record, so an interrupted run keeps all
+    the questions converted up to the last flush.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.f = open(path, 'w', encoding='utf-8')
+        self.count = 0
+
+    def write(self, question):
+        self.f.write(json.dumps(question, ensure_ascii=False))
+        self.f.write('\n')
+        self.count += 1
+        if self.count % FLUSH_EVERY == 0:
+            self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+COMPACT_DIR_NAME = "d2l_compact"  # --compact output folder, next to OUTPUT_JSON
+COMPACT_IMAGE_PREFIX = "$img/"    # stands for BASE_IMAGE_URL + "/" in compact image URLs
+
+
+def compact_dir():
+    return os.path.join(os.path.dirname(OUTPUT_JSON), COMPACT_DIR_NAME)
+
+
+def map_strings(value, fn):
+    """Apply `fn` to every string inside a JSON value."""
+    if isinstance(value, str):
+        return fn(value)
+    if isinstance(value, list):
+        return [map_strings(v, fn) for v in value]
+    if isinstance(value, dict):
+        return {k: map_strings(v, fn) for k, v in value.items()}
+    return value
+
+
+def compact_question(question, image_base):
+    """The compact form of a converted question.
+
+    The section is dropped (it is the shard's), image URLs under image_base
+    become COMPACT_IMAGE_PREFIX + name and, when every correct answer is one
+    of the options, "correct_answers" is replaced by "correct": their option
+    indices.
+    """
+    absolute = f'src="{image_base}/'
+    relative = f'src="{COMPACT_IMAGE_PREFIX}'
+    record = {}
+    options = question.get("options")
+    for key, value in question.items():
+        if key == "section":
+            continue
+        if key == "correct_answers" and options is not None and all(a in options for a in value):
+            record["correct"] = [options.index(answer) for answer in value]
+            continue
+        record[key] = map_strings(value, lambda text: text.replace(absolute, relative))
+    return record
+
+
+def expand_question(record, section, image_base):
+    """Inverse of compact_question()."""
+    relative = f'src="{COMPACT_IMAGE_PREFIX}'
+    absolute = f'src="{image_base}/'
+    question = {}
+    for key, value in record.items():
+        if key == "correct":
+            question["correct_answers"] = [record["options"][i] for i in value]
+            continue
+        question[key] = map_strings(value, lambda text: text.replace(relative, absolute))
+        if key == "id":
+            question["section"] = section
+    return question
+
+
+class CompactShardWriter:
+    """Write questions as gzipped NDJSON shards, one per section, plus a manifest.
+
+    A new shard starts whenever the section changes. manifest.json lists every
+    shard with its section title, question count, types and id range, so a
+    consumer can load one section at a time; image URLs are relative to the
+    manifest's "image_base" (see compact_question).
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, "manifest.json")
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            if name.endswith('.ndjson.gz'):
+                os.remove(os.path.join(directory, name))  # shards of an earlier run
+        self.shards = []
+        self.f = None
+        self.section = None
+        self.count = 0
+
+    def start_shard(self, section):
+        self.close_shard()
+        slug = re.sub(r'[^A-Za-z0-9]+', '-', section).strip('-').lower()[:40] or 'section'
+        name = f"{len(self.shards) + 1:03d}-{slug}.ndjson.gz"
+        self.f = gzip.open(os.path.join(self.directory, name), 'wt', encoding='utf-8')
+        self.section = section
+        self.shards.append({"file": name, "section": section, "count": 0, "types": {}})
+
+    def close_shard(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+            shard = self.shards[-1]
+            shard["bytes"] = os.path.getsize(os.path.join(self.directory, shard["file"]))
+
+    def write(self, question):
+        if self.f is None or question["section"] != self.section:
+            self.start_shard(question["section"])
+        self.f.write(json.dumps(compact_question(question, BASE_IMAGE_URL), ensure_ascii=False,
+                                separators=(',', ':')))
+        self.f.write('\n')
+        shard = self.shards[-1]
+        shard["count"] += 1
+        shard["types"][question["type"]] = shard["types"].get(question["type"], 0) + 1
+        shard.setdefault("first_id", question["id"])
+        shard["last_id"] = question["id"]
+        self.count += 1
+
+    def close(self):
+        self.close_shard()
+        manifest = {
+            "format": "d2l-compact",
+            "version": 1,
+            "image_base": BASE_IMAGE_URL,
+            "image_prefix": COMPACT_IMAGE_PREFIX,
+            "count": self.count,
+            "shards": self.shards,
+        }
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+
+def iter_compact_questions(directory, section=None):
+    """Read questions back from a --compact folder, optionally one section only."""
+    with open(os.path.join(directory, "manifest.json"), encoding='utf-8') as f:
+        manifest = json.load(f)
+    for shard in manifest["shards"]:
+        if section is not None and shard["section"] != section:
+            continue
+        with gzip.open(os.path.join(directory, shard["file"]), 'rt', encoding='utf-8') as f:
+            for line in f:
+                yield expand_question(json.loads(line), shard["section"], manifest["image_base"])
+
+
+SEARCH_INDEX_NAME = "d2l_search.sqlite"  # --search-index output, next to OUTPUT_JSON
+
+
+def search_index_path():
+    return os.path.join(os.path.dirname(OUTPUT_JSON), SEARCH_INDEX_NAME)
+
+
+def plain_text(html_text):
+    """Tag-stripped, entity-decoded text for the search index."""
+    return ' '.join(html.unescape(strip_html_tags(html_text or '')).split())
+
+
+def question_answer_texts(question):
+    """Every option / answer string of a converted question."""
+    texts = list(question.get("options", []))
+    texts += question.get("correct_answers", [])
+    texts += question.get("ordered_items", [])
+    for pair in question.get("matching_pairs", []):
+        texts += [pair["premise"], pair["response"]]
+    return texts
+
+
+class SearchIndexWriter:
+    """SQLite FTS5 index of the converted questions, filled while they are written.
+
+    Columns: question_id, section and type (filterable, not tokenized) and
+    the plain text of the question and of its options and answers. Diacritics
+    are folded, so "metodo" also finds "método".
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.exists(path):
+            os.remove(path)
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            "CREATE VIRTUAL TABLE questions USING fts5("
+            " question_id UNINDEXED, section UNINDEXED, type UNINDEXED, question, options,"
+            " tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        self.rows = []
+
+    def add(self, question):
+        self.rows.append((
+            question["id"],
+            question["section"],
+            question["type"],
+            plain_text(question.get("question")),
+            '\n'.join(plain_text(text) for text in question_answer_texts(question)),
+        ))
+        if len(self.rows) >= FLUSH_EVERY:
+            self.flush()
+
+    def flush(self):
+        self.db.executemany("INSERT INTO questions VALUES (?, ?, ?, ?, ?)", self.rows)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        self.db.execute("INSERT INTO questions(questions) VALUES ('optimize')")
+        self.db.commit()
+        self.db.close()
+        print(f"Search index written to: {self.path}")
+
+
+def search_questions(query, path=None, section=None, q_type=None, limit=20):
+    """Print the best matches for an FTS5 query from a --search-index file."""
+    path = path or search_index_path()
+    if not os.path.exists(path):
+        print(f"Error: {path} not found, run --convert --search-index first")
+        sys.exit(1)
+    sql = ("SELECT question_id, section, type, snippet(questions, -1, '[', ']', '...', 12)"
+           " FROM questions WHERE questions MATCH ?")
+    params = [query]
+    if section:
+        sql += " AND section = ?"
+        params.append(section)
+    if q_type:
+        sql += " AND type = ?"
+        params.append(q_type)
+    sql += " ORDER BY bm25(questions, 0, 0, 0, 2.0, 1.0) LIMIT ?"
+    params.append(limit)
+
+    db = sqlite3.connect(path)
+    try:
+        rows = db.execute(sql, params).fetchall()
+    except sqlite3.OperationalError as e:
+        print(f"Error: invalid search query: {e}")
+        sys.exit(1)
+    finally:
+        db.close()
+    for question_id, section_title, q_type_, snippet in rows:
+        print(f"  {question_id:>6}  [{q_type_}] {section_title}: {snippet.replace(chr(10), ' | ')}")
+    print(f"{len(rows)} results")
+
+
+NEAR_DUP_SHINGLE = 5         # characters per shingle
+NEAR_DUP_BINS = 128          # MinHash signature length
+NEAR_DUP_BANDS = 32          # LSH bands (4 bins each): pairs above ~0.4 similarity become candidates
+NEAR_DUP_THRESHOLD = 0.7     # estimated Jaccard similarity reported as a near-duplicate
+NEAR_DUP_MAX_COMPARE = 8     # bucket members kept, and full comparisons per new question
+
+
+def near_duplicate_path():
+    return os.path.join(os.path.dirname(OUTPUT_JSON), "d2l_near_duplicates.json")
+
+
+def near_duplicate_text(question):
+    """Question plus option/answer text, without tags, case, accents or punctuation."""
+    texts = [question.get("question", "")] + question_answer_texts(question)
+    text = unicodedata.normalize('NFKD', ' '.join(normalize_text(t) for t in texts))
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(re.sub(r'[^\w\s]', ' ', text).split())
+
+
+class NearDuplicateIndex:
+    """MinHash signatures with an LSH index, built one question at a time.
+
+    Each question is shingled into NEAR_DUP_SHINGLE-character substrings of
+    near_duplicate_text() and summarized by a one-permutation MinHash: every
+    shingle is hashed once and each of the NEAR_DUP_BINS bins keeps the
+    smallest hash that falls into it (empty bins borrow the next filled one),
+    so a signature costs one hash per shingle. Questions that share a band
+    of their signature are compared, with at most NEAR_DUP_MAX_COMPARE
+    earlier members per bucket, so work grows linearly with the bank.
+    Matches above NEAR_DUP_THRESHOLD are merged into clusters with
+    union-find.
+    """
+
+    def __init__(self):
+        self.rows = NEAR_DUP_BINS // NEAR_DUP_BANDS
+        self.buckets = {}
+        self.signatures = []
+        self.questions = []  # (source, id, section, type, preview)
+        self.parent = []
+        self.matches = []    # (index, index, similarity)
+
+    def signature(self, text):
+        shingles = {text[i:i + NEAR_DUP_SHINGLE] for i in range(max(1, len(text) - NEAR_DUP_SHINGLE + 1))}
+        bins = [None] * NEAR_DUP_BINS
+        for shingle in shingles:
+            h = int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big')
+            b, value = h % NEAR_DUP_BINS, h // NEAR_DUP_BINS
+            if bins[b] is None or value < bins[b]:
+                bins[b] = value
+        # Walk backwards twice so every empty bin sees the next filled one, wrapping around.
+        # The distance is kept so borrowed values only match equally empty bins.
+        signature = [None] * NEAR_DUP_BINS
+        borrowed, distance = None, 0
+        for b in reversed(range(2 * NEAR_DUP_BINS)):
+            b %= NEAR_DUP_BINS
+            if bins[b] is not None:
+                borrowed, distance = bins[b], 0
+                signature[b] = borrowed
+            elif borrowed is not None:
+                distance += 1
+                signature[b] = (borrowed, distance)
+        return tuple(signature)
+
+    def root(self, i):
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def add(self, question, source=None):
+        text = near_duplicate_text(question)
+        if not text:
+            return
+        signature = self.signature(text)
+        index = len(self.signatures)
+        self.signatures.append(signature)
+        self.questions.append((source, question["id"], question.get("section"), question["type"], text[:80]))
+        self.parent.append(index)
+
+        candidates = Counter()
+        for band in range(NEAR_DUP_BANDS):
+            key = (band, hash(signature[band * self.rows:(band + 1) * self.rows]))
+            bucket = self.buckets.setdefault(key, [])
+            candidates.update(bucket)
+            if len(bucket) < NEAR_DUP_MAX_COMPARE:
+                bucket.append(index)
+
+        # Candidates sharing the most bands first; at most NEAR_DUP_MAX_COMPARE full comparisons
+        compared = 0
+        for other, _ in candidates.most_common():
+            if compared == NEAR_DUP_MAX_COMPARE:
+                break
+            if self.root(other) == self.root(index):
+                continue
+            compared += 1
+            similarity = sum(map(operator.eq, signature, self.signatures[other])) / NEAR_DUP_BINS
+            if similarity >= NEAR_DUP_THRESHOLD:
+                self.parent[self.root(other)] = self.root(index)
+                self.matches.append((other, index, similarity))
+
+    def clusters(self):
+        """Clusters of two or more questions, largest first."""
+        members = {}
+        for i in range(len(self.questions)):
+            members.setdefault(self.root(i), []).append(i)
+        matches = {}
+        for a, b, similarity in self.matches:
+            matches.setdefault(self.root(a), []).append((a, b, similarity))
+
+        def describe(i):
+            source, question_id, section, q_type, preview = self.questions[i]
+            entry = {"id": question_id, "section": section, "type": q_type, "text": preview}
+            if source is not None:
+                entry["source"] = source
+            return entry
+
+        clusters = []
+        for root, indices in members.items():
+            if len(indices) < 2:
+                continue
+            pairs = matches.get(root, [])
+            clusters.append({
+                "size": len(indices),
+                "max_similarity": max(similarity for _, _, similarity in pairs),
+                "min_similarity": min(similarity for _, _, similarity in pairs),
+                "questions": [describe(i) for i in indices],
+                "pairs": [{"a": self.questions[a][1], "b": self.questions[b][1], "similarity": similarity}
+                          for a, b, similarity in pairs],
+            })
+        clusters.sort(key=lambda cluster: (-cluster["size"], -cluster["max_similarity"]))
+        return clusters
+
+    def write_report(self, path=None):
+        path = path or near_duplicate_path()
+        clusters = self.clusters()
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"threshold": NEAR_DUP_THRESHOLD, "questions": len(self.questions), "clusters": clusters},
+                      f, ensure_ascii=False, indent=2)
+        in_clusters = sum(cluster["size"] for cluster in clusters)
+        print(f"\nNear-duplicates: {len(clusters)} clusters covering {in_clusters} of "
+              f"{len(self.questions)} questions, written to: {path}")
+        for cluster in clusters[:10]:
+            ids = ', '.join(str(q["id"]) for q in cluster["questions"][:8])
+            print(f"  {cluster['size']} questions (similarity {cluster['min_similarity']:.2f}-"
+                  f"{cluster['max_similarity']:.2f}): {ids}{' ...' if cluster['size'] > 8 else ''}")
+
+
+def find_near_duplicates(paths):
+    """Near-duplicate report across converted outputs, e.g. several courses."""
+    index = NearDuplicateIndex()
+    for path in paths:
+        source = os.path.basename(os.path.normpath(path))
+        count = 0
+        for question in iter_questions(path):
+            index.add(question, source if len(paths) > 1 else None)
+            count += 1
+        print(f"  {path}: {count} questions")
+    index.write_report()
+
+
+FACET_INDEX_NAME = "d2l_facets.json"  # category x type facets, with a .csv of the counts beside it
+
+
+def facet_index_path():
+    return os.path.join(os.path.dirname(OUTPUT_JSON), FACET_INDEX_NAME)
+
+
+def id_ranges(ids):
+    """Sorted ids as [first, last] runs of consecutive ids."""
+    ranges = []
+    for question_id in ids:
+        if ranges and question_id == ranges[-1][1] + 1:
+            ranges[-1][1] = question_id
+        else:
+            ranges.append([question_id, question_id])
+    return ranges
+
+
+def expand_ranges(ranges):
+    return [question_id for first, last in ranges for question_id in range(first, last + 1)]
+
+
+class FacetIndex:
+    """Question ids per category (section) and question_bank type.
+
+    Facets are written sorted by category and type, with ids ascending as
+    id_ranges(), so the same bank always gives the same file. The counts
+    also go to a CSV in question_bank_facets form, keyed as --load inserts
+    the questions (category = section, all approved). It covers this
+    export only; refresh_question_bank_facets() in
+    database/migrations/add_question_facets.sql is authoritative.
+    """
+
+    def __init__(self):
+        self.ids = {}  # (category, type) -> question ids
+
+    def add(self, question):
+        key = (question["section"], QUESTION_BANK_TYPES.get(question["type"], 'open_ended'))
+        self.ids.setdefault(key, []).append(question["id"])
+
+    def write(self, path=None):
+        path = path or facet_index_path()
+        facets = [{"category": category, "type": q_type, "count": len(ids), "ids": id_ranges(sorted(ids))}
+                  for (category, q_type), ids in sorted(self.ids.items())]
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"format": "d2l-facets", "version": 1, "count": sum(len(ids) for ids in self.ids.values()),
+                       "facets": facets}, f, ensure_ascii=False, separators=(',', ':'))
+        with open(os.path.splitext(path)[0] + '.csv', 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["category", "type", "question_count"])
+            for facet in facets:
+                writer.writerow([facet["category"], facet["type"], facet["count"]])
+        print(f"Facet index: {len(facets)} category/type facets written to: {path}")
+
+
+def build_facet_index(paths):
+    """Facet index over converted outputs (JSON, NDJSON or --compact)."""
+    index = FacetIndex()
+    for path in paths:
+        for question in iter_questions(path):
+            index.add(question)
+    index.write()
+
+
+def sample_from_facets(count, path=None, categories=None, seed=None):
+    """Stratified random question ids read from the facet index alone.
+
+    Every category x type facet gets a share of `count` proportional to its
+    size (largest remainder), so the exam mirrors the bank's mix. Returns
+    (category, type, id) tuples in facet order.
+    """
+    with open(path or facet_index_path(), encoding='utf-8') as f:
+        facets = json.load(f)["facets"]
+    if categories:
+        facets = [facet for facet in facets if facet["category"] in categories]
+    total = sum(facet["count"] for facet in facets)
+    count = min(count, total)
+    if not count:
+        return []
+
+    shares = [count * facet["count"] / total for facet in facets]
+    quotas = [int(share) for share in shares]
+    by_remainder = sorted(range(len(facets)), key=lambda i: quotas[i] - shares[i])
+    for i in by_remainder[:count - sum(quotas)]:
+        quotas[i] += 1
+
+    rng = random.Random(seed)
+    picks = []
+    for facet, quota in zip(facets, quotas):
+        for question_id in sorted(rng.sample(expand_ranges(facet["ids"]), quota)):
+            picks.append((facet["category"], facet["type"], question_id))
+    return picks
+
+
+class ConversionStats:
+    """Running counters for the end-of-run summary."""
+
+    def __init__(self):
+        self.total = 0
+        self.type_counts = {}
+        self.img_count = 0
+        self.errors = []
+        self.duplicates = 0
+
+    def add(self, question):
+        self.total += 1
+        t = question['type']
+        self.type_counts[t] = self.type_counts.get(t, 0) + 1
+        if '<img' in question.get('question', '') or \
+                any('<img' in opt for opt in question.get('options', [])):
+            self.img_count += 1
+
+    def print_summary(self):
+        print(f"\nSummary:")
+        for t, count in sorted(self.type_counts.items()):
+            print(f"  {t}: {count}")
+        print(f"  Total: {self.total}")
+        if self.duplicates:
+            print(f"  Duplicates of earlier imports: {self.duplicates}")
+
+        if self.errors:
+            print(f"\nErrors ({len(self.errors)}):")
+            for err in self.errors[:20]:
+                print(f"  {err}")
+            if len(self.errors) > 20:
+                print(f"  ... and {len(self.errors) - 20} more")
+
+        print(f"\nQuestions with images: {self.img_count}")
+
+
+def convert_xml_to_json(stream=False, ndjson=False, jobs=1, xml_path=None,
+                        referenced_only=False, media_files=None, dedupe=None, cache=False,
+                        on_question=None, compact=False, search_index=False, near_duplicates=False,
+                        facets=False):
+    """Parse D2L XML and convert to JSON format compatible with importService.ts.
+
+    With stream=True the XML is read incrementally instead of loading the whole
+    tree. Questions are always written as soon as they are converted; with
+    ndjson=True they go to OUTPUT_NDJSON, one per line, and with compact=True
+    to gzipped per-section shards (see CompactShardWriter). With jobs > 1 items
+    are converted on a process pool; the output is identical to a serial run.
+    xml_path defaults to XML_PATH and may also be a ZipMember.
+
+    With referenced_only=True the images each question references are saved
+    to image_refs_path() for upload_images(referenced_only=True), and broken
+    references and unused files of `media_files` (default: the Fotos folder)
+    are reported.
+
+    With dedupe='drop' or 'flag', questions whose fingerprint is already in
+    the fingerprint index (or earlier in this export) are left out or written
+    with "duplicate": true.
+
+    With cache=True unchanged items are taken from the parse cache and only
+    new or edited items are converted.
+
+    on_question(question_id, image_refs) is called for every question written.
+    With search_index=True an FTS5 index of them is built at search_index_path(),
+    with near_duplicates=True a near-duplicate report at near_duplicate_path()
+    and with facets=True a category x type facet index at facet_index_path().
+    """
+    xml_path = xml_path or XML_PATH
+    if stream:
+        records = iter_items_streaming(xml_path)
+    else:
+        records = iter_items_tree(xml_path)
+    if profiler is not None:
+        records = profiler.timed_iter("parse xml", records)
+
+    if compact:
+        writer = CompactShardWriter(compact_dir())
+    elif ndjson:
+        writer = NdjsonWriter(OUTPUT_NDJSON)
+    else:
+        writer = JsonArrayWriter(OUTPUT_JSON)
+
+    stats = ConversionStats()
+    image_refs = {}  # filename -> question ids referencing it
+    index = SearchIndexWriter(search_index_path()) if search_index else None
+    near_duplicate_index = NearDuplicateIndex() if near_duplicates else None
+    facet_index = FacetIndex() if facets else None
+    fingerprints = load_fingerprint_index() if dedupe else None
+    parse_cache = ParseCache() if cache else None
+
+    def convert(records):
+        if jobs > 1:
+            yield from convert_parallel(records, jobs)
+            return
+        for record in records:
+            if record is None:
+                yield None
+                continue
+            question_id, section_title, item = record
+            if profiler is None:
+                yield (question_id, *convert_item(item, question_id, section_title))
+                continue
+            start = time.perf_counter()
+            result = convert_item(item, question_id, section_title)
+            seconds = time.perf_counter() - start
+            profiler.add_phase("convert items", seconds)
+            profiler.add_item(item.get('ident'), result[0]["type"] if result[0] else "(failed)", seconds)
+            yield (question_id, *result)
+
+    def converted():
+        if parse_cache is None:
+            yield from convert(records)
+            return
+
+        hits = deque()  # cached results waiting to be yielded
+        keys = {}       # question_id -> cache key of items being converted
+
+        def uncached():
+            """Items to convert; each hit yields None so convert() hands control back
+            and the hit is passed on right away (in_id_order() holds it only while
+            an earlier miss is still being converted)."""
+            for question_id, section_title, item in records:
+                key = ParseCache.item_key(item)
+                cached = parse_cache.get(key)
+                if cached is None:
+                    keys[question_id] = key
+                    yield question_id, section_title, item
                 else:
-                    errors.append(f"Question {question_id}: Unknown type '{q_type}'")
-                    continue
+                    question, refs = cached
+                    hits.append((question_id, {"id": question_id, "section": section_title, **question},
+                                 None, refs))
+                    yield None
+
+        for result in convert(uncached()):
+            while hits:
+                yield hits.popleft()
+            if result is None:
+                continue
+            question_id, question_data, error, refs = result
+            key = keys.pop(question_id)
+            if error is None:
+                parse_cache.put(key, question_data, refs)
+            yield result
+        while hits:
+            yield hits.popleft()
+
+    saved = {}
+    if profiler is not None:
+        # Time the text helpers wherever the parsers call them
+        for name in ("decode_html_text", "replace_image_urls"):
+            saved[name] = globals()[name]
+            globals()[name] = profiler.timed(name, saved[name])
+        if fingerprints is not None:
+            saved["question_fingerprint"] = question_fingerprint
+            globals()["question_fingerprint"] = profiler.timed("dedupe", question_fingerprint)
+        writer.write = profiler.timed("write output", writer.write)
 
-                if result is None:
-                    errors.append(f"Question {question_id}: Failed to parse ({q_type})")
-                    continue
+    try:
+        for question_id, question_data, error, refs in in_id_order(converted()):
+            if error:
+                stats.errors.append(error)
+                continue
+            if fingerprints is not None:
+                fingerprint = question_fingerprint(transform_question(question_data))
+                if fingerprint in fingerprints:
+                    stats.duplicates += 1
+                    if dedupe == 'drop':
+                        continue
+                    question_data = {**question_data, "duplicate": True}
+                else:
+                    fingerprints.add(fingerprint)
+            writer.write(question_data)
+            stats.add(question_data)
+            if index is not None:
+                index.add(question_data)
+            if near_duplicate_index is not None:
+                near_duplicate_index.add(question_data)
+            if facet_index is not None:
+                facet_index.add(question_data)
+            for ref in refs:
+                question_ids = image_refs.setdefault(ref, [])
+                if not question_ids or question_ids[-1] != question_id:
+                    question_ids.append(question_id)
+            if on_question is not None:
+                on_question(question_id, refs)
+    finally:
+        globals().update(saved)
+        with profile_phase("write output"):
+            writer.close()
+            if index is not None:
+                index.close()
+        if parse_cache is not None:
+            parse_cache.close()
+
+    print(f"\nWrote {writer.count} questions to: {writer.path}")
+    stats.print_summary()
+    inline_images = list_inline_images()
+    if inline_images:
+        print(f"Images from inline data: URIs: {len(inline_images)} in {inline_images_dir()}")
+    if near_duplicate_index is not None:
+        near_duplicate_index.write_report()
+    if facet_index is not None:
+        facet_index.write()
+
+    if referenced_only:
+        with open(image_refs_path(), 'w', encoding='utf-8') as f:
+            json.dump({"referenced": image_refs}, f, ensure_ascii=False, indent=2, sort_keys=True)
+        print(f"\nWrote {len(image_refs)} image references to: {image_refs_path()}")
+        if media_files is None:
+            media_files = list_media_files()
+        if media_files is not None:
+            report_image_refs(image_refs, media_files)
+
+
+def check_backends(xml_path=None):
+    """Convert the export with every available XML backend and compare.
+
+    Both the tree and the streaming reader are run per backend; any question
+    whose result differs from the ElementTree tree run is reported. Returns
+    True when all runs agree.
+    """
+    xml_path = xml_path or XML_PATH
+    saved = xml_backend.name
+    names = [name for name in XML_BACKENDS if name == 'etree' or lxml_etree is not None]
+    results = {}
+    try:
+        for name in names:
+            set_xml_backend(name)
+            for stream in (False, True):
+                start = time.perf_counter()
+                with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                    records = iter_items_streaming(xml_path) if stream else iter_items_tree(xml_path)
+                    converted = sorted((question_id, *convert_item(item, question_id, section_title))
+                                       for question_id, section_title, item in records)
+                run = f"{name} {'stream' if stream else 'tree'}"
+                results[run] = converted
+                print(f"  {run}: {len(converted)} items in {time.perf_counter() - start:.2f}s")
+    finally:
+        set_xml_backend(saved)
+
+    reference_run, reference = next(iter(results.items()))
+    identical = True
+    for run, converted in results.items():
+        differences = [ours[0] for ours, theirs in zip(converted, reference) if ours != theirs]
+        if len(converted) != len(reference):
+            differences.append(f"{len(converted)} items vs {len(reference)}")
+        if differences:
+            identical = False
+            print(f"  {run} differs from {reference_run} at: {', '.join(map(str, differences[:20]))}")
+
+    if identical:
+        print(f"All {len(results)} runs produced identical output")
+    return identical
+
+
+QTI_EXPORT_NAME = "questiondb.xml"  # written next to OUTPUT_JSON by --export-qti
+QTI_TITLE_LENGTH = 100              # characters of question text used as the item title
+
+
+def qti_export_path():
+    return os.path.join(os.path.dirname(OUTPUT_JSON), QTI_EXPORT_NAME)
+
+
+def qti_html(html_text):
+    """Question HTML as D2L stores it in <mattext>.
+
+    Storage URLs go back to the bare (still URL-encoded) filenames of the
+    export, and '&' is escaped once more because the parsers unescape
+    mattext after the XML parser has.
+    """
+    prefix = f'src="{BASE_IMAGE_URL}/'
+    return (html_text or "").replace(prefix, 'src="').replace('&', '&amp;')
+
+
+class QtiWriter:
+    """Writes a D2L questiondb.xml one element at a time.
+
+    Nothing but the open element names is kept, so memory does not grow
+    with the bank. Each question becomes an <item> that parse_item() reads
+    back into the same question; a new <section> starts whenever the
+    question's section changes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self.section = None
+        self.file = open(path, 'w', encoding='utf-8')
+        self.xml = XMLGenerator(self.file, 'UTF-8', short_empty_elements=True)
+        self.xml.startDocument()
+        self.xml.startElement('questestinterop', {})
+        self.xml.startElement('objectbank', {'ident': 'OB_examspot'})
+
+    @contextlib.contextmanager
+    def element(self, tag, **attrs):
+        self.xml.startElement(tag, attrs)
+        yield
+        self.xml.endElement(tag)
+
+    def leaf(self, tag, text=None, **attrs):
+        with self.element(tag, **attrs):
+            if text:
+                self.xml.characters(text)
+
+    def material(self, html_text):
+        with self.element('material'):
+            self.leaf('mattext', qti_html(html_text), texttype='text/html')
+
+    def metadata(self, q_type):
+        with self.element('itemmetadata'), self.element('qtimetadata'):
+            for label, entry in (('qmd_computerscored', 'yes'), ('qmd_questiontype', q_type)):
+                with self.element('qti_metadatafield'):
+                    self.leaf('fieldlabel', label)
+                    self.leaf('fieldentry', entry)
+
+    def choices(self, tag, labels, **attrs):
+        """<response_lid>/<response_grp> with one response_label per (ident, html)."""
+        with self.element(tag, **attrs), self.element('render_choice', shuffle='yes'):
+            for ident, html_text in labels:
+                with self.element('flow_label', **{'class': 'Block'}), self.element('response_label', ident=ident):
+                    self.material(html_text)
+
+    def condition(self, respident, value, score, varname='D2L_Correct', action='Set', negated=()):
+        with self.element('respcondition'):
+            with self.element('conditionvar'):
+                for other in ([value] if isinstance(value, str) else value):
+                    self.leaf('varequal', other, respident=respident)
+                for other in negated:
+                    with self.element('not'):
+                        self.leaf('varequal', other, respident=respident)
+            self.leaf('setvar', str(score), varname=varname, action=action)
+
+    def start_section(self, title):
+        if self.section is not None:
+            self.xml.endElement('section')
+        self.section = title
+        self.xml.startElement('section', {'ident': f'SECT_{self.count + 1}', 'title': title})
+
+    def write(self, question):
+        """Write one question; False when its type cannot be exported."""
+        q_type = question.get("type")
+        write_body = QTI_WRITERS.get(q_type)
+        if write_body is None:
+            return False
+        section = question.get("section") or 'Sin sección'
+        if section != self.section:
+            self.start_section(section)
+
+        ident = f'QUES_{question["id"]}'
+        title = plain_text(question.get("question", ""))[:QTI_TITLE_LENGTH]
+        with self.element('item', ident=ident, label=ident, title=title):
+            self.metadata(q_type)
+            write_body(self, ident, question)
+        self.count += 1
+        return True
+
+    def close(self):
+        if self.section is not None:
+            self.xml.endElement('section')
+        self.xml.endElement('objectbank')
+        self.xml.endElement('questestinterop')
+        self.xml.endDocument()
+        self.file.close()
+
+
+def correct_positions(options, answers):
+    """Option positions of the correct answers, repeated texts matched in order."""
+    positions = set()
+    for answer in answers:
+        position = next((i for i, option in enumerate(options) if option == answer and i not in positions), None)
+        if position is not None:
+            positions.add(position)
+    return positions
+
+
+def write_choice_item(writer, ident, question, multiple=False):
+    options = question.get("options", [])
+    if question.get("type") == 'True/False':
+        options = list(dict.fromkeys(options + question.get("correct_answers", [])))
+    correct = correct_positions(options, question.get("correct_answers", []))
+    labels = [f'{ident}_A{i}' for i in range(len(options))]
+
+    with writer.element('presentation'), writer.element('flow'):
+        writer.material(question.get("question"))
+        writer.choices('response_lid', zip(labels, options), ident=f'{ident}_LID',
+                       rcardinality='Multiple' if multiple else 'Single')
+    with writer.element('resprocessing'):
+        if multiple:
+            # One condition: the correct options selected and none of the others
+            writer.condition(f'{ident}_LID', [labels[i] for i in sorted(correct)], 100,
+                             negated=[label for i, label in enumerate(labels) if i not in correct])
+        else:
+            for i, label in enumerate(labels):
+                writer.condition(f'{ident}_LID', label, 100 if i in correct else 0)
+
+
+def write_fill_blank_item(writer, ident, question):
+    parts = question.get("question", "").split('___')
+    answers = question.get("correct_answers", [])
+    with writer.element('presentation'), writer.element('flow'):
+        for n, part in enumerate(parts):
+            if part:
+                writer.material(part)
+            if n < len(parts) - 1:
+                with writer.element('response_str', ident=f'{ident}_B{n}', rcardinality='Single'):
+                    writer.leaf('render_fib', fibtype='String', prompt='Box', columns='30', rows='1')
+    with writer.element('resprocessing'):
+        for n, answer in enumerate(answers[:len(parts) - 1]):
+            if answer:
+                writer.condition(f'{ident}_B{n}', answer, 100)
+
+
+def write_matching_item(writer, ident, question):
+    pairs = question.get("matching_pairs", [])
+    responses = list(dict.fromkeys(pair["response"] for pair in pairs if pair.get("response")))
+    choices = [(f'{ident}_C{i}', response) for i, response in enumerate(responses)]
+
+    with writer.element('presentation'), writer.element('flow'):
+        writer.material(question.get("question"))
+        for g, pair in enumerate(pairs):
+            with writer.element('response_grp', respident=f'{ident}_G{g}', rcardinality='Single'):
+                writer.material(pair.get("premise"))
+                with writer.element('render_choice', shuffle='yes'):
+                    for choice_ident, response in choices:
+                        with writer.element('flow_label', **{'class': 'Block'}), \
+                                writer.element('response_label', ident=choice_ident):
+                            writer.material(response)
+    with writer.element('resprocessing'):
+        for g, pair in enumerate(pairs):
+            for choice_ident, response in choices:
+                correct = response == pair.get("response")
+                writer.condition(f'{ident}_G{g}', choice_ident, 1 if correct else 0, action='Add',
+                                 varname='D2L_Correct' if correct else 'D2L_Incorrect')
+
+
+def write_ordering_item(writer, ident, question):
+    labels = [(f'{ident}_O{i}', text) for i, text in enumerate(question.get("ordered_items", []))]
+    with writer.element('presentation'), writer.element('flow'):
+        writer.material(question.get("question"))
+        writer.choices('response_grp', labels, respident=f'{ident}_GRP', rcardinality='Ordered')
+    with writer.element('resprocessing'):
+        for position, (label, _) in enumerate(labels, 1):
+            writer.condition(label, str(position), 1, action='Add')
+
+
+def write_short_answer_item(writer, ident, question):
+    with writer.element('presentation'), writer.element('flow'):
+        writer.material(question.get("question"))
+        with writer.element('response_str', ident=f'{ident}_SA', rcardinality='Single'), \
+                writer.element('render_fib', fibtype='String', prompt='Box', columns='30', rows='1'):
+            writer.leaf('response_label', ident=f'{ident}_SAL')
+    with writer.element('resprocessing'):
+        for answer in question.get("correct_answers", []):
+            writer.condition(f'{ident}_SAL', answer, 100)
+
+
+QTI_WRITERS = {
+    'Multiple Choice': write_choice_item,
+    'Multi-Select': lambda writer, ident, question: write_choice_item(writer, ident, question, multiple=True),
+    'True/False': write_choice_item,
+    'Fill in the Blanks': write_fill_blank_item,
+    'Matching': write_matching_item,
+    'Ordering': write_ordering_item,
+    'Short Answer': write_short_answer_item,
+}
+
+
+def export_qti(source=None, xml_path=None):
+    """Write converted questions (JSON, NDJSON or --compact) as a D2L questiondb.xml."""
+    source = source or OUTPUT_JSON
+    xml_path = xml_path or qti_export_path()
+    writer = QtiWriter(xml_path)
+    skipped = Counter()
+    try:
+        for question in iter_questions(source):
+            if not writer.write(question):
+                skipped[question.get("type")] += 1
+    finally:
+        writer.close()
+
+    print(f"Wrote {writer.count} questions to: {xml_path}")
+    for q_type, count in skipped.items():
+        print(f"  Skipped {count} questions of unsupported type {q_type!r}")
+    return xml_path
+
+
+def check_qti_roundtrip(source=None, xml_path=None):
+    """Parse an exported questiondb.xml back with parse_item() and compare.
+
+    Questions are matched in order, so the source must be the file the XML
+    was exported from. Returns True when every question comes back unchanged.
+    """
+    source = source or OUTPUT_JSON
+    xml_path = xml_path or qti_export_path()
+    originals = (question for question in iter_questions(source) if question.get("type") in QTI_WRITERS)
+    checked = 0
+    mismatches = []
+    with open(os.devnull, 'w') as devnull:
+        records = iter_items_streaming(xml_path)
+        for original in originals:
+            with contextlib.redirect_stdout(devnull):
+                record = next(records, None)
+            if record is None:
+                mismatches.append(f"{original['id']}: missing from the XML")
+                break
+            _, section_title, item = record
+            question_data, error, _ = convert_item(item, original["id"], section_title)
+            # Flags and derived keys are not part of the D2L item
+            expected = {key: value for key, value in original.items() if key not in ("duplicate", "answer_keys")}
+            checked += 1
+            if error:
+                mismatches.append(error)
+                continue
+            question_data.pop("answer_keys", None)
+            if question_data != expected:
+                keys = sorted(key for key in expected.keys() | question_data.keys()
+                              if expected.get(key) != question_data.get(key))
+                mismatches.append(f"{original['id']}: {', '.join(keys)} differ")
+
+    for mismatch in mismatches[:20]:
+        print(f"  {mismatch}")
+    if len(mismatches) > 20:
+        print(f"  ... and {len(mismatches) - 20} more")
+    print(f"Round trip: {checked - len(mismatches)} of {checked} questions identical")
+    return not mismatches
+
+
+class ZipMember:
+    """A file inside a D2L export zip, with the parts of the Path API we use.
+
+    Every open() gets its own ZipFile handle, so entries can be streamed from
+    several upload threads at once without extracting anything to disk.
+    """
+
+    def __init__(self, archive, info):
+        self.archive = archive
+        self.info = info
+        self.name = posixpath.basename(info.filename)
+        self.suffix = posixpath.splitext(self.name)[1]
+
+    def __str__(self):
+        return f"{self.archive}:{self.info.filename}"
+
+    def __lt__(self, other):
+        return self.name < other.name
+
+    def stat(self):
+        return SimpleNamespace(
+            st_size=self.info.file_size,
+            st_mtime=time.mktime(self.info.date_time + (0, 0, -1)),
+        )
+
+    def open(self, mode='rb'):
+        archive = zipfile.ZipFile(self.archive)
+        member = archive.open(self.info)
+        archive.close()  # the open member keeps the file alive until it is closed
+        return member
+
+
+def find_export_entries(archive):
+    """Return (questiondb.xml member or None, image members) of an export zip."""
+    with zipfile.ZipFile(archive) as zf:
+        infos = zf.infolist()
+
+    xml_member = None
+    images = {}
+    for info in infos:
+        if info.is_dir():
+            continue
+        member = ZipMember(archive, info)
+        if member.name.lower() == 'questiondb.xml':
+            xml_member = xml_member or member
+        elif member.suffix.lower() in IMAGE_EXTENSIONS:
+            if member.name in images:
+                print(f"  Warning: duplicate image name {member.name}, keeping {images[member.name]}")
+                continue
+            images[member.name] = member
+    return xml_member, list(images.values())
+
+
+@contextlib.contextmanager
+def archive_namespace(archive):
+    """Point storage and output paths at a namespace named after the archive.
+
+    Images go to STORAGE_PATH/<name>/ and outputs to ARCHIVES_OUTPUT_DIR/<name>/,
+    so exports converted side by side never overwrite each other.
+    """
+    name = re.sub(r'[^A-Za-z0-9._-]+', '_', Path(archive).stem)
+    saved = {key: globals()[key] for key in NAMESPACED_SETTINGS}
+    output_dir = os.path.join(ARCHIVES_OUTPUT_DIR, name)
+    os.makedirs(output_dir, exist_ok=True)
+
+    storage_path = f"{STORAGE_PATH}/{name}"
+    globals().update(
+        STORAGE_PATH=storage_path,
+        BASE_IMAGE_URL=f"{SUPABASE_URL}/storage/v1/object/public/{STORAGE_BUCKET}/{storage_path}",
+        OUTPUT_JSON=os.path.join(output_dir, os.path.basename(OUTPUT_JSON)),
+        OUTPUT_NDJSON=os.path.join(output_dir, os.path.basename(OUTPUT_NDJSON)),
+        UPLOAD_MANIFEST=os.path.join(output_dir, os.path.basename(UPLOAD_MANIFEST)),
+    )
+    try:
+        yield name
+    finally:
+        globals().update(saved)
+
+
+def process_archive(archive, upload=False, convert=True, ndjson=False, compact=False, search_index=False,
+                    near_duplicates=False, facets=False, workers=None, verify_remote=False, referenced_only=False,
+                    dedupe=None, cache=False, pipeline=False, optimize=None, image_variant=None):
+    """Upload and/or convert one D2L export zip straight from the archive.
+
+    Output is captured and returned as text so that archives processed in
+    parallel do not interleave their progress lines.
+    """
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        try:
+            with archive_namespace(archive) as name:
+                print(f"Archive: {archive} (namespace: {name})")
+                xml_member, images = find_export_entries(archive)
+                if optimize is not None:
+                    images = optimize_images(images, **optimize)
+                if image_variant not in (None, 'optimized'):
+                    load_image_variants(image_variant)
+
+                if pipeline and upload and convert and xml_member is not None:
+                    run_pipeline(files=images, workers=workers, verify_remote=verify_remote,
+                                 stream=True, ndjson=ndjson, compact=compact, search_index=search_index,
+                                 near_duplicates=near_duplicates, facets=facets, xml_path=xml_member,
+                                 dedupe=dedupe, cache=cache)
+                else:
+                    upload_first = upload and not referenced_only
+                    if upload_first:
+                        print(f"Found {len(images)} images in the archive")
+                        upload_images(workers=workers, verify_remote=verify_remote, files=images)
+
+                    if convert:
+                        if xml_member is None:
+                            print("Error: no questiondb.xml in the archive")
+                        else:
+                            convert_xml_to_json(stream=True, ndjson=ndjson, compact=compact,
+                                                search_index=search_index, near_duplicates=near_duplicates,
+                                                facets=facets,
+                                                xml_path=xml_member,
+                                                referenced_only=referenced_only, media_files=images,
+                                                dedupe=dedupe, cache=cache)
+
+                    # The referenced set comes from the conversion, so upload after it
+                    if upload and not upload_first:
+                        upload_images(workers=workers, verify_remote=verify_remote, files=images,
+                                      referenced_only=True)
+                    elif upload and convert:
+                        upload_inline_images(workers=workers)
+        except (Exception, SystemExit) as e:
+            print(f"Error processing {archive}: {e}")
+    return log.getvalue()
+
+
+def process_archives(archives, jobs=1, **options):
+    """Process several export zips, `jobs` archives at a time."""
+    if jobs <= 1:
+        for archive in archives:
+            print(process_archive(archive, **options))
+        return
+
+    with ProcessPoolExecutor(max_workers=min(jobs, len(archives)), initializer=configure_worker,
+                             initargs=(worker_config(),)) as executor:
+        futures = [executor.submit(process_archive, archive, **options) for archive in archives]
+        for future in as_completed(futures):
+            print(future.result())
+
+
+QUESTION_BANK_TYPES = {
+    'Multiple Choice': 'multiple_choice',
+    'True/False': 'true_false',
+    'Multi-Select': 'multi_select',
+    'Fill in the Blanks': 'fill_blank',
+    'Matching': 'matching',
+    'Ordering': 'ordering',
+    'Short Answer': 'written_response',
+}
+
+QUESTION_BANK_COLUMNS = (
+    'created_by', 'status', 'category', 'tags', 'type', 'question_text',
+    'options', 'correct_answer', 'terms', 'points', 'is_public',
+)
+QUESTION_BANK_JSON_COLUMNS = ('options', 'correct_answer', 'terms', 'answer_keys')
+
+
+def question_bank_columns(rows):
+    """QUESTION_BANK_COLUMNS, plus answer_keys when a row has them (output of
+    --answer-keys; the column is added by database/migrations/add_answer_keys.sql).
+    """
+    if any("answer_keys" in row for row in rows):
+        return QUESTION_BANK_COLUMNS + ('answer_keys',)
+    return QUESTION_BANK_COLUMNS
+
+
+def transform_question(q):
+    """Map a converted question to a question_bank row.
+
+    Mirrors transformQuestion() in src/services/importService.ts; keep the two
+    in sync.
+    """
+    q_type = q['type']
+    row = {
+        "category": q['section'],
+        "tags": [q_type],
+        "type": QUESTION_BANK_TYPES.get(q_type, 'open_ended'),
+        "question_text": q['question'],
+        "options": None,
+        "points": 10,
+        "is_public": False,
+    }
+    correct_answers = q.get('correct_answers') or []
+
+    if q_type == 'Multiple Choice':
+        options = q.get('options') or []
+        correct_index = next((i for i, opt in enumerate(options) if opt in correct_answers), 0)
+        row.update(options=options, correct_answer=correct_index)
+    elif q_type == 'True/False':
+        # D2L returns "True" or "False" text values
+        correct = correct_answers[0] if correct_answers else None
+        row.update(options=['Verdadero', 'Falso'],
+                   correct_answer=0 if correct and correct.lower().startswith('true') else 1)
+    elif q_type == 'Multi-Select':
+        options = q.get('options') or []
+        row.update(options=options,
+                   correct_answer=[options.index(ans) for ans in correct_answers if ans in options])
+    elif q_type == 'Fill in the Blanks':
+        row.update(correct_answer=correct_answers)
+    elif q_type == 'Matching':
+        row.update(correct_answer=None, terms=[
+            {"term": p['premise'], "definition": p['response']} for p in q.get('matching_pairs') or []
+        ])
+    elif q_type == 'Ordering':
+        # options = items to order (shuffled for display), correct_answer = correct order
+        items = q.get('ordered_items') or []
+        row.update(options=items, correct_answer=items)
+    else:
+        row.update(correct_answer=(correct_answers[0] if correct_answers else None) or '')
+    if q.get('answer_keys') is not None:
+        row["answer_keys"] = q['answer_keys']
+    return row
+
+
+def iter_questions(path):
+    """Read converted questions from a JSON array, an NDJSON file or a --compact folder."""
+    if os.path.isdir(path):
+        yield from iter_compact_questions(path)
+    elif path.endswith('.ndjson'):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        with open(path, encoding='utf-8') as f:
+            yield from json.load(f)
+
+
+def get_user_id(session, headers):
+    """Id of the authenticated user (rows are created on their behalf)."""
+    resp = session.get(f"{SUPABASE_URL}/auth/v1/user", headers=headers)
+    if resp.status_code != 200:
+        print(f"Could not read the authenticated user: {resp.status_code} {resp.text[:200]}")
+        sys.exit(1)
+    return resp.json()["id"]
+
+
+def fetch_existing_texts(session, headers, user_id):
+    """Lower-cased question texts the user already has, paged like PostgREST wants."""
+    texts = set()
+    offset = 0
+    while True:
+        resp = session.get(
+            f"{SUPABASE_URL}/rest/v1/question_bank",
+            headers=headers,
+            params={
+                "select": "question_text",
+                "created_by": f"eq.{user_id}",
+                "order": "id",
+                "offset": offset,
+                "limit": LOAD_BATCH_SIZE,
+            },
+        )
+        if resp.status_code != 200:
+            raise RuntimeError(f"reading question_bank failed: {resp.status_code} {resp.text[:200]}")
+        page = resp.json()
+        texts.update(row["question_text"].lower().strip() for row in page)
+        if len(page) < LOAD_BATCH_SIZE:
+            return texts
+        offset += LOAD_BATCH_SIZE
+
+
+def insert_rows(session, headers, rows):
+    """Insert rows into question_bank, isolating the ones that fail.
+
+    A batch rejected by the API (4xx) is split in half and retried until each
+    bad row is on its own, so one broken question costs O(log n) extra
+    requests instead of falling back to inserting every row individually.
+    Server errors are not retried, since the batch may already be stored.
+    Returns (inserted count, [(question id, error message)]).
+    """
+    for attempt in range(UPLOAD_RETRIES + 1):
+        resp = session.post(
+            f"{SUPABASE_URL}/rest/v1/question_bank",
+            headers={**headers, "Prefer": "return=minimal"},
+            params={"columns": ",".join(question_bank_columns(row for _, row in rows))},
+            data=json.dumps([row for _, row in rows], ensure_ascii=False).encode('utf-8'),
+        )
+        # 429 means the batch was rejected unprocessed, so sending it again is safe
+        if resp.status_code != 429 or attempt == UPLOAD_RETRIES:
+            break
+        time.sleep(UPLOAD_BACKOFF * 2 ** attempt)
+    if resp.status_code in (200, 201, 204):
+        return len(rows), []
+
+    if resp.status_code == 429 or resp.status_code >= 500:
+        # The batch may have been committed before the error, and the inserts
+        # are plain POSTs: resending (or splitting) it could store rows twice.
+        # A later --load skips whatever did get in.
+        message = f"HTTP {resp.status_code}, batch not retried; run --load again to insert what is missing"
+        return 0, [(question_id, message) for question_id, _ in rows]
+
+    if len(rows) == 1:
+        try:
+            message = resp.json().get("message", resp.text)
+        except ValueError:
+            message = resp.text
+        return 0, [(rows[0][0], message[:200])]
+
+    middle = len(rows) // 2
+    inserted_a, errors_a = insert_rows(session, headers, rows[:middle])
+    inserted_b, errors_b = insert_rows(session, headers, rows[middle:])
+    return inserted_a + inserted_b, errors_a + errors_b
 
-                question_data = {
-                    "id": question_id,
-                    "section": section_title,
-                    "type": q_type,
-                    **result,
+
+def load_question_bank(path, workers=None, section=None):
+    """Bulk-insert converted questions into question_bank through PostgREST.
+
+    Same mapping, duplicate check (case-insensitive question text) and
+    'approved' status as importQuestionsFromJSON() in importService.ts, but
+    with LOAD_BATCH_SIZE rows per request and `workers` requests in flight.
+    """
+    workers = workers or LOAD_WORKERS
+    access_token = authenticate()
+    headers = {
+        "Authorization": f"Bearer {access_token}",
+        "apikey": SUPABASE_KEY,
+        "Content-Type": "application/json",
+    }
+
+    total = 0
+    duplicates = 0
+    imported = 0
+    errors = []
+
+    session = create_session(workers, retry_post=False)
+    with session:
+        user_id = get_user_id(session, headers)
+        existing = fetch_existing_texts(session, headers, user_id)
+        print(f"{len(existing)} questions already in the bank")
+
+        def batches():
+            nonlocal total, duplicates
+            batch = []
+            for q in iter_questions(path):
+                if section and q['section'] != section:
+                    continue
+                total += 1
+                key = q['question'].lower().strip()
+                if key in existing:
+                    duplicates += 1
+                    continue
+                existing.add(key)
+                row = {
+                    **transform_question(q),
+                    "created_by": user_id,
+                    "status": 'approved',  # Imported questions are auto-approved
                 }
+                batch.append((q['id'], row))
+                if len(batch) == LOAD_BATCH_SIZE:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            in_flight = deque()
+
+            def collect(future):
+                nonlocal imported
+                inserted, batch_errors = future.result()
+                imported += inserted
+                errors.extend(batch_errors)
+                print(f"  Progress: {imported} imported, {len(errors)} errors")
+
+            for batch in batches():
+                in_flight.append(executor.submit(insert_rows, session, headers, batch))
+                if len(in_flight) >= workers * 2:
+                    collect(in_flight.popleft())
+            while in_flight:
+                collect(in_flight.popleft())
+
+    print(f"\nLoad complete: {total} questions, {imported} imported, "
+          f"{duplicates} duplicates, {len(errors)} errors")
+    for question_id, message in errors[:20]:
+        print(f"  Pregunta #{question_id}: {message}")
+    if len(errors) > 20:
+        print(f"  ... and {len(errors) - 20} more")
+
+
+def write_copy_file(path, copy_path, created_by, section=None):
+    """Write question_bank rows as CSV for psql's \\copy (no API round trips)."""
+    columns = question_bank_columns(transform_question(q) for q in iter_questions(path))
+    count = 0
+    with open(copy_path, 'w', encoding='utf-8', newline='') as f:
+        # Everything is quoted; FORCE_NULL below turns empty JSON fields into NULL
+        writer = csv.writer(f, quoting=csv.QUOTE_NONNUMERIC)
+        writer.writerow(columns)
+        for q in iter_questions(path):
+            if section and q['section'] != section:
+                continue
+            row = {**transform_question(q), "created_by": created_by, "status": 'approved'}
+            writer.writerow([copy_value(column, row.get(column)) for column in columns])
+            count += 1
+
+    print(f"Wrote {count} rows to: {copy_path}")
+    print("Load with:")
+    print(f"  \\copy question_bank ({', '.join(columns)}) FROM '{copy_path}' "
+          f"WITH (FORMAT csv, HEADER true, "
+          f"FORCE_NULL ({', '.join(c for c in columns if c in QUESTION_BANK_JSON_COLUMNS)}))")
+
+
+def copy_value(column, value):
+    """Render one value for PostgreSQL's CSV COPY format (None = NULL)."""
+    if value is None:
+        return ''  # only used by the JSON columns, which are loaded with FORCE_NULL
+    if column == 'tags':
+        # text[] literal: {"a","b"}
+        return '{' + ','.join('"' + t.replace('\\', '\\\\').replace('"', '\\"') + '"' for t in value) + '}'
+    if column in QUESTION_BANK_JSON_COLUMNS:
+        return json.dumps(value, ensure_ascii=False)
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return value
+
+
+def normalize_text(html_text):
+    """Plain comparable text: tags stripped, entities decoded, case and
+    whitespace folded. Images are kept as [img:name] so questions that differ
+    only in their picture stay distinct.
+    """
+    if not html_text:
+        return ""
+    text = IMG_SRC_RE.sub(lambda m: f" [img:{normalize_media_name(m.group(1))}] ", html_text)
+    text = html.unescape(strip_html_tags(text))
+    return ' '.join(unicodedata.normalize('NFKC', text).casefold().split())
 
-                questions.append(question_data)
 
-            except Exception as e:
-                errors.append(f"Question {question_id} ({q_type}): {str(e)}")
+def normalize_value(value):
+    """normalize_text() applied to every string inside a JSON value."""
+    if isinstance(value, str):
+        return normalize_text(value)
+    if isinstance(value, list):
+        return [normalize_value(v) for v in value]
+    if isinstance(value, dict):
+        return {k: normalize_value(v) for k, v in sorted(value.items())}
+    return value
 
-    # Write JSON
-    print(f"\nWriting {len(questions)} questions to: {OUTPUT_JSON}")
-    with open(OUTPUT_JSON, 'w', encoding='utf-8') as f:
-        json.dump(questions, f, ensure_ascii=False, indent=2)
 
-    # Summary
-    type_counts = {}
-    for q in questions:
-        t = q['type']
-        type_counts[t] = type_counts.get(t, 0) + 1
+def question_fingerprint(row):
+    """Content fingerprint of a question_bank row or transform_question() result.
 
-    print(f"\nSummary:")
-    for t, count in sorted(type_counts.items()):
-        print(f"  {t}: {count}")
-    print(f"  Total: {len(questions)}")
+    Covers the type, question text, options, correct answer and matching
+    terms after normalization, so re-exported copies of a question hash the
+    same whether they come from a converted file or from the database.
+    """
+    canonical = json.dumps([
+        row.get('type'),
+        normalize_text(row.get('question_text')),
+        normalize_value(row.get('options')),
+        normalize_value(row.get('correct_answer')),
+        normalize_value(row.get('terms')),
+    ], ensure_ascii=False, separators=(',', ':'))
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def iter_bank_rows(path):
+    """question_bank-shaped rows from a converted output or a database dump.
+
+    Accepts converted JSON/NDJSON (mapped with transform_question), JSON or
+    NDJSON dumps of question_bank rows, and CSV dumps such as a Supabase
+    table export or psql \\copy output.
+    """
+    if path.endswith('.csv'):
+        with open(path, encoding='utf-8', newline='') as f:
+            for row in csv.DictReader(f):
+                for column in ('options', 'correct_answer', 'terms'):
+                    row[column] = json.loads(row[column]) if row.get(column) else None
+                yield row
+        return
 
-    if errors:
-        print(f"\nErrors ({len(errors)}):")
-        for err in errors[:20]:
-            print(f"  {err}")
-        if len(errors) > 20:
-            print(f"  ... and {len(errors) - 20} more")
+    for record in iter_questions(path):
+        yield record if 'question_text' in record else transform_question(record)
 
-    # Count questions with images
-    img_count = sum(1 for q in questions if '<img' in q.get('question', '') or
-                    any('<img' in opt for opt in q.get('options', [])))
-    print(f"\nQuestions with images: {img_count}")
+
+def load_fingerprint_index():
+    """Set of fingerprints of earlier imports (empty if there is no index)."""
+    try:
+        with open(FINGERPRINT_INDEX, encoding='utf-8') as f:
+            return {line.strip() for line in f if line.strip()}
+    except FileNotFoundError:
+        print(f"Warning: no fingerprint index at {FINGERPRINT_INDEX}, run --build-fingerprints first")
+        return set()
+
+
+def build_fingerprint_index(paths):
+    """Add the fingerprints of every question in `paths` to the index."""
+    fingerprints = load_fingerprint_index() if os.path.exists(FINGERPRINT_INDEX) else set()
+    before = len(fingerprints)
+    for path in paths:
+        count = 0
+        for row in iter_bank_rows(path):
+            fingerprints.add(question_fingerprint(row))
+            count += 1
+        print(f"  {path}: {count} questions")
+
+    tmp_path = FINGERPRINT_INDEX + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for fingerprint in sorted(fingerprints):
+            f.write(fingerprint + '\n')
+    os.replace(tmp_path, FINGERPRINT_INDEX)
+    print(f"Fingerprint index: {len(fingerprints)} entries ({len(fingerprints) - before} new) in {FINGERPRINT_INDEX}")
+
+
+def get_option(args, name, default=None):
+    """Return the value that follows `name` in args, or default if absent."""
+    if name not in args:
+        return default
+    i = args.index(name)
+    if i + 1 >= len(args):
+        print(f"Error: {name} needs a value")
+        sys.exit(1)
+    return args[i + 1]
+
+
+def get_option_list(args, name):
+    """Return every value after `name` up to the next --option."""
+    if name not in args:
+        return []
+    values = []
+    for arg in args[args.index(name) + 1:]:
+        if arg.startswith('--'):
+            break
+        values.append(arg)
+    return values
 
 
 def main():
@@ -622,20 +3819,261 @@ def main():
         print("  python3 scripts/importD2L.py --upload-images   Upload images to Supabase Storage")
         print("  python3 scripts/importD2L.py --convert          Convert XML to JSON")
         print("  python3 scripts/importD2L.py --all              Do both")
+        print("  Options: --stream  parse XML incrementally (large exports)")
+        print("           --ndjson  write one question per line (d2l_questions.ndjson)")
+        print("           --compact  write gzipped per-section shards and a manifest (d2l_compact/)")
+        print("           --search-index  also build an SQLite FTS5 index (d2l_search.sqlite)")
+        print("           --near-duplicates  also report clusters of near-duplicate questions")
+        print("           --answer-keys  add normalized accepted answers (all variants) to fill-blank/short answer")
+        print("           --facets  also write d2l_facets.json/.csv (question ids and counts per section x type)")
+        print("           --jobs N  convert items on N processes")
+        print("           --workers N  concurrent image uploads (default 8)")
+        print("           --verify-remote  check the upload manifest against the bucket listing")
+        print("           --zip A.zip [B.zip ...]  read D2L export archives directly")
+        print("           --referenced-only  upload only images the converted questions use")
+        print("  python3 scripts/importD2L.py --search QUERY [--section S] [--type T] [--limit N] [--index FILE]")
+        print("  python3 scripts/importD2L.py --near-duplicates [FILE ...]  Near-duplicates across converted outputs")
+        print("  python3 scripts/importD2L.py --facets [FILE ...]  Facet index of converted outputs")
+        print("  python3 scripts/importD2L.py --facet-sample N [--section S ...] [--seed K] [--index FILE]")
+        print("  python3 scripts/importD2L.py --load [FILE]      Bulk-insert converted questions into question_bank")
+        print("  Options: --section NAME  only load one section")
+        print("           --copy-file OUT.csv --created-by UUID  write a COPY file instead of inserting")
+        print("  python3 scripts/importD2L.py --build-fingerprints [FILE ...]  Index questions already imported")
+        print("  --convert --dedupe drop|flag   drop or flag questions found in the fingerprint index")
+        print("  --convert --cache              reuse converted items that did not change since the last run")
+        print("  --all --pipeline               upload images while converting, as questions reference them")
+        print("  --optimize [--webp] [--capped [N]]  recompress images before upload")
+        print("                                 (--webp / --capped also add WebP / size-capped variants)")
+        print("  --image-variant optimized|webp|capped  which optimized object the converted URLs point at")
+        print("  --profile                      write per-phase timings and latencies to d2l_profile.json")
+        print("  --backend lxml|etree           XML parser (default: lxml when installed)")
+        print("  python3 scripts/importD2L.py --scan [XML]  Per-type summary from the metadata only (no conversion)")
+        print("  python3 scripts/importD2L.py --check-backends [XML]  Compare the output of both XML backends")
+        print("  python3 scripts/importD2L.py --export-qti [FILE] [--out XML] [--check-roundtrip]")
+        print("                                 Write converted questions back to a D2L questiondb.xml")
+        return
+
+    if '--backend' in args:
+        backend = get_option(args, '--backend')
+        if backend not in XML_BACKENDS:
+            print(f"Error: --backend must be one of: {', '.join(XML_BACKENDS)}")
+            sys.exit(1)
+        set_xml_backend(backend)
+
+    if '--answer-keys' in args:
+        global ANSWER_KEYS
+        ANSWER_KEYS = True
+
+    if '--scan' in args:
+        print("=" * 50)
+        print("SCANNING XML METADATA")
+        print("=" * 50)
+        scan_export((get_option_list(args, '--scan') or [None])[0])
+        return
+
+    if '--check-backends' in args:
+        print("=" * 50)
+        print("CHECKING XML BACKEND PARITY")
+        print("=" * 50)
+        if not check_backends((get_option_list(args, '--check-backends') or [None])[0]):
+            sys.exit(1)
+        return
+
+    if '--search' in args:
+        limit = get_option(args, '--limit')
+        search_questions(get_option(args, '--search'), path=get_option(args, '--index'),
+                         section=get_option(args, '--section'), q_type=get_option(args, '--type'),
+                         limit=int(limit) if limit else 20)
+        return
+
+    if '--export-qti' in args:
+        print("=" * 50)
+        print("EXPORTING QUESTIONS TO D2L XML")
+        print("=" * 50)
+        source = (get_option_list(args, '--export-qti') or [None])[0]
+        xml_path = export_qti(source, get_option(args, '--out'))
+        if '--check-roundtrip' in args and not check_qti_roundtrip(source, xml_path):
+            sys.exit(1)
+        return
+
+    if '--near-duplicates' in args and not ('--convert' in args or '--all' in args):
+        print("=" * 50)
+        print("FINDING NEAR-DUPLICATE QUESTIONS")
+        print("=" * 50)
+        find_near_duplicates(get_option_list(args, '--near-duplicates') or [OUTPUT_JSON])
+        return
+
+    if '--facets' in args and not ('--convert' in args or '--all' in args):
+        print("=" * 50)
+        print("BUILDING FACET INDEX")
+        print("=" * 50)
+        build_facet_index(get_option_list(args, '--facets') or [OUTPUT_JSON])
+        return
+
+    if '--facet-sample' in args:
+        seed = get_option(args, '--seed')
+        picks = sample_from_facets(int(get_option(args, '--facet-sample')), path=get_option(args, '--index'),
+                                   categories=get_option_list(args, '--section'),
+                                   seed=int(seed) if seed is not None else None)
+        for category, q_type, question_id in picks:
+            print(f"{question_id}\t{q_type}\t{category}")
+        print(f"{len(picks)} questions")
         return
 
-    if '--upload-images' in args or '--all' in args:
+    if '--build-fingerprints' in args:
+        print("=" * 50)
+        print("BUILDING FINGERPRINT INDEX")
+        print("=" * 50)
+        build_fingerprint_index(get_option_list(args, '--build-fingerprints') or [OUTPUT_JSON])
+        return
+
+    if '--dedupe' in args and get_option(args, '--dedupe') not in ('drop', 'flag'):
+        print("Error: --dedupe must be 'drop' or 'flag'")
+        sys.exit(1)
+
+    if '--load' in args:
+        path = (get_option_list(args, '--load') or [OUTPUT_JSON])[0]
+        section = get_option(args, '--section')
+        copy_path = get_option(args, '--copy-file')
+        print("=" * 50)
+        print("LOADING QUESTIONS INTO question_bank")
+        print("=" * 50)
+        if copy_path:
+            created_by = get_option(args, '--created-by')
+            if not created_by:
+                print("Error: --copy-file needs --created-by <profile uuid>")
+                sys.exit(1)
+            write_copy_file(path, copy_path, created_by, section=section)
+        else:
+            load_question_bank(path, workers=int(get_option(args, '--workers', LOAD_WORKERS)), section=section)
+        return
+
+    optimize = None
+    if '--optimize' in args:
+        capped = get_option_list(args, '--capped')
+        optimize = {
+            "webp": '--webp' in args,
+            "max_dimension": (int(capped[0]) if capped else IMAGE_MAX_DIMENSION) if '--capped' in args else None,
+        }
+    image_variant = get_option(args, '--image-variant')
+    if image_variant is not None and image_variant not in IMAGE_VARIANTS:
+        print(f"Error: --image-variant must be one of: {', '.join(IMAGE_VARIANTS)}")
+        sys.exit(1)
+
+    if '--pipeline' in args and not (('--upload-images' in args and '--convert' in args) or '--all' in args):
+        print("Error: --pipeline uploads while converting, use it with --all")
+        sys.exit(1)
+
+    archives = get_option_list(args, '--zip')
+    if archives and '--profile' in args:
+        print("Error: --profile is not supported with --zip, profile one export with --convert")
+        sys.exit(1)
+    if archives:
+        print("=" * 50)
+        print(f"PROCESSING {len(archives)} D2L EXPORT ARCHIVES")
+        print("=" * 50)
+        process_archives(
+            archives,
+            jobs=int(get_option(args, '--jobs', 1)),
+            upload='--upload-images' in args or '--all' in args,
+            convert='--convert' in args or '--all' in args,
+            ndjson='--ndjson' in args,
+            compact='--compact' in args,
+            search_index='--search-index' in args,
+            near_duplicates='--near-duplicates' in args,
+            facets='--facets' in args,
+            dedupe=get_option(args, '--dedupe'),
+            cache='--cache' in args,
+            workers=int(get_option(args, '--workers', UPLOAD_WORKERS)),
+            verify_remote='--verify-remote' in args,
+            referenced_only='--referenced-only' in args,
+            pipeline='--pipeline' in args,
+            optimize=optimize,
+            image_variant=image_variant,
+        )
+        return
+
+    global profiler
+    if '--profile' in args:
+        profiler = Profiler()
+
+    referenced_only = '--referenced-only' in args
+    media_files = None  # the Fotos folder, unless --optimize replaces it
+
+    if optimize is not None:
+        print("=" * 50)
+        print("OPTIMIZING IMAGES")
+        print("=" * 50)
+        files = list_media_files()
+        if files is None:
+            return
+        media_files = optimize_images(files, jobs=int(get_option(args, '--jobs', 0)) or None,
+                                      webp=optimize["webp"], max_dimension=optimize["max_dimension"])
+        print()
+    if image_variant not in (None, 'optimized'):
+        load_image_variants(image_variant)
+
+    def upload_step():
         print("=" * 50)
         print("UPLOADING IMAGES TO SUPABASE STORAGE")
         print("=" * 50)
-        upload_images()
+        upload_images(workers=int(get_option(args, '--workers', UPLOAD_WORKERS)),
+                      verify_remote='--verify-remote' in args,
+                      files=media_files,
+                      referenced_only=referenced_only)
         print()
 
-    if '--convert' in args or '--all' in args:
+    def convert_step():
         print("=" * 50)
         print("CONVERTING XML TO JSON")
         print("=" * 50)
-        convert_xml_to_json()
+        convert_xml_to_json(stream='--stream' in args, ndjson='--ndjson' in args,
+                            jobs=int(get_option(args, '--jobs', 1)),
+                            referenced_only=referenced_only,
+                            media_files=media_files,
+                            dedupe=get_option(args, '--dedupe'),
+                            cache='--cache' in args,
+                            compact='--compact' in args,
+                            search_index='--search-index' in args,
+                            near_duplicates='--near-duplicates' in args,
+                            facets='--facets' in args)
+
+    upload = '--upload-images' in args or '--all' in args
+    convert = '--convert' in args or '--all' in args
+
+    if '--pipeline' in args and upload and convert:
+        print("=" * 50)
+        print("CONVERTING XML AND UPLOADING IMAGES (PIPELINE)")
+        print("=" * 50)
+        run_pipeline(files=media_files,
+                     workers=int(get_option(args, '--workers', UPLOAD_WORKERS)),
+                     verify_remote='--verify-remote' in args,
+                     stream='--stream' in args, ndjson='--ndjson' in args,
+                     jobs=int(get_option(args, '--jobs', 1)),
+                     dedupe=get_option(args, '--dedupe'),
+                     cache='--cache' in args,
+                     compact='--compact' in args,
+                     search_index='--search-index' in args,
+                     near_duplicates='--near-duplicates' in args,
+                     facets='--facets' in args)
+    elif referenced_only:
+        # Uploads need the references collected by the conversion
+        if convert:
+            convert_step()
+            print()
+        if upload:
+            upload_step()
+    else:
+        if upload:
+            upload_step()
+        if convert:
+            convert_step()
+        if upload and convert:
+            # Images extracted from data: URIs only exist after the conversion
+            upload_inline_images(workers=int(get_option(args, '--workers', UPLOAD_WORKERS)))
+
+    if profiler is not None:
+        profiler.write_report()
 
 
 if __name__ == '__main__':
@@ -48,9 +48,23 @@ export function gradeMultipleChoice(question: Question, answer: unknown): GradeR
   return { isCorrect: false, score: 0 }
 }
 
+function decodeEntities(text: string): string {
+  const textarea = document.createElement('textarea')
+  textarea.innerHTML = text
+  return textarea.value
+}
+
+// Same as normalize_answer() in scripts/importD2L.py, which builds answer_keys
+export function normalizeAnswer(text: string): string {
+  const plain = decodeEntities(decodeEntities(text).replace(/<[^>]+>/g, '').trim())
+  return plain.split(/\s+/).filter(Boolean).join(' ').normalize('NFC').toLowerCase()
+}
+
 export async function gradeFillBlank(question: Question, answer: unknown): Promise<GradeResult> {
   const correctAnswers = question.correct_answer as string[]
   const userAnswers = answer as string[]
+  // Every accepted variant per blank, when imported with --answer-keys
+  const answerKeys = question.answer_keys
 
   if (!Array.isArray(correctAnswers) || !Array.isArray(userAnswers)) {
     return { isCorrect: false, score: 0 }
@@ -60,8 +74,12 @@ export async function gradeFillBlank(question: Question, answer: unknown): Promi
   for (let i = 0; i < correctAnswers.length; i++) {
     const correct = (correctAnswers[i] || '').trim().toLowerCase()
     const user = (userAnswers[i] || '').trim().toLowerCase()
+    const keys = answerKeys?.[i]
+    const isMatch = keys?.length
+      ? keys.includes(normalizeAnswer(userAnswers[i] || ''))
+      : correct === user
 
-    if (correct === user) {
+    if (isMatch) {
       correctCount++
     } else if (user.length > 0) {
       // Try AI synonym check for non-empty wrong answers
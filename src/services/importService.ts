@@ -8,6 +8,7 @@ interface CreateQuestionBankData {
   options?: string[] | null
   correct_answer: unknown
   terms?: MatchingTerm[] | null
+  answer_keys?: string[][] | null
   points?: number
   explanation?: string | null
   is_public?: boolean
@@ -23,6 +24,7 @@ interface ImportedQuestion {
   correct_answers?: string[]
   matching_pairs?: { premise: string; response: string }[]
   ordered_items?: string[]
+  answer_keys?: string[][]
 }
 
 function mapQuestionType(jsonType: string): QuestionType {
@@ -110,6 +112,8 @@ function transformQuestion(q: ImportedQuestion): CreateQuestionBankData {
         question_text: q.question,
         options: null,
         correct_answer: q.correct_answers || [],
+        // Only present with --answer-keys; needs add_answer_keys.sql
+        ...(q.answer_keys ? { answer_keys: q.answer_keys } : {}),
         points: 10,
         is_public: false,
       }
@@ -157,6 +161,7 @@ function transformQuestion(q: ImportedQuestion): CreateQuestionBankData {
         question_text: q.question,
         options: null,
         correct_answer: q.correct_answers?.[0] || '',
+        ...(q.answer_keys ? { answer_keys: q.answer_keys } : {}),
         points: 10,
         is_public: false,
       }
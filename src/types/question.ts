@@ -24,6 +24,7 @@ export interface Question {
   options: string[] | null
   correct_answer: unknown
   terms: MatchingTerm[] | null
+  answer_keys?: string[][] | null
   points: number
   explanation: string | null
   material_reference: string | null
@@ -60,6 +61,7 @@ export interface QuestionBankItem {
   options: string[] | null
   correct_answer: unknown
   terms: MatchingTerm[] | null
+  answer_keys?: string[][] | null
 
   // Additional
   explanation: string | null